@@ -0,0 +1,299 @@
+"""Headless benchmark of completion latency.
+
+Replays typing sessions against a fresh analysis server and reports the
+latency distribution of every completion stage as JSON: queue wait, jedi
+Script construction and complete() as timed by the server, the round trip
+seen by the client and QsciAPIs.prepare() (skipped without PyQt5).
+
+Sessions are either recorded from the editor, which appends every message
+it sends to the analysis server to a log when ZRAX_SESSION_LOG is set:
+
+    ZRAX_SESSION_LOG=session.jsonl python src/main.py
+    python benchmarks/completion_bench.py --session session.jsonl --realtime
+
+or made up by retyping random lines of the python files of real projects,
+asking for completions where the editor would (at the start of every
+identifier and after every dot):
+
+    python benchmarks/completion_bench.py --path ~/projects/app --files 20 --lines 5
+    python benchmarks/completion_bench.py --path ~/projects/app --save-session typed.jsonl
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.join(HERE, "..", "src")
+sys.path.insert(0, SRC)
+
+from latency import COMPLETION_STAGES, percentile
+
+SERVER_PATH = os.path.join(SRC, "analysis_server.py")
+# seconds between two synthetic keystrokes, used by --realtime
+KEYSTROKE_INTERVAL = 0.1
+# notifications replayed from a session, other requests than complete are skipped
+REPLAYED_NOTIFICATIONS = {"open", "change", "close", "prewarm", "index", "saved"}
+
+
+def python_files(paths: list) -> list:
+    files = []
+    for path in paths:
+        if os.path.isfile(path):
+            files.append(os.path.abspath(path))
+            continue
+        for d, dirs, names in os.walk(path):
+            dirs[:] = sorted(n for n in dirs if n not in {"__pycache__", ".git", "venv", "node_modules"})
+            files.extend(os.path.abspath(os.path.join(d, n)) for n in sorted(names) if n.endswith(".py"))
+    return files
+
+
+def retype_line(uri: str, lines: list, row: int, version: int, clock: float) -> tuple:
+    """Session events typing lines[row] back into a document that has it blanked.
+
+    Returns (events, version, clock). Changes are sent right before each
+    completion request, like the editor syncs its documents.
+    """
+    line = lines[row].rstrip("\r\n")
+    indent = len(line) - len(line.lstrip())
+    offset = len("".join(lines[:row]).encode("utf-8"))
+    events = [{"time": clock, "message": {"method": "change", "params": {
+        "uri": uri, "version": version + 1,
+        "changes": [{"start": offset, "end": offset + len(line.encode("utf-8")), "text": line[:indent]}],
+    }}}]
+    version += 1
+    synced = indent
+    quote = None
+    for column in range(indent, len(line)):
+        char = line[column]
+        clock += KEYSTROKE_INTERVAL
+        if quote:
+            quote = None if char == quote else quote
+            continue
+        if char in "\"'":
+            quote = char
+            continue
+        if char == "#":
+            break
+        previous = line[column - 1] if column > indent else " "
+        if char == ".":
+            ask = column + 1
+        elif (char.isalpha() or char == "_") and not (previous.isalnum() or previous == "_"):
+            # the editor asks at the start of the identifier for every name
+            ask = column
+        else:
+            continue
+        typed = line[synced:column + 1]
+        start = offset + len(line[:synced].encode("utf-8"))
+        version += 1
+        events.append({"time": clock, "message": {"method": "change", "params": {
+            "uri": uri, "version": version, "changes": [{"start": start, "end": start, "text": typed}],
+        }}})
+        events.append({"time": clock, "message": {"id": 0, "method": "complete", "params": {
+            "uri": uri, "version": version, "line": row + 1, "column": ask,
+        }}})
+        synced = column + 1
+    rest = line[synced:]
+    if rest:
+        start = offset + len(line[:synced].encode("utf-8"))
+        version += 1
+        events.append({"time": clock, "message": {"method": "change", "params": {
+            "uri": uri, "version": version, "changes": [{"start": start, "end": start, "text": rest}],
+        }}})
+    return events, version, clock
+
+
+def make_session(paths: list, files: int, lines_per_file: int, seed: int) -> list:
+    """Events of a made up session retyping random lines of the files under `paths`"""
+    rnd = random.Random(seed)
+    candidates = python_files(paths)
+    rnd.shuffle(candidates)
+    events = []
+    clock = 0.0
+    for path in paths:
+        if os.path.isdir(path):
+            events.append({"time": clock, "message": {"method": "prewarm", "params": {"root": os.path.abspath(path)}}})
+    opened = 0
+    for path in candidates:
+        if opened >= files:
+            break
+        try:
+            with open(path, encoding="utf-8") as f:
+                lines = f.readlines()
+        except (OSError, UnicodeDecodeError):
+            continue
+        rows = [i for i, line in enumerate(lines) if line.strip() and not line.lstrip().startswith("#")]
+        if not rows:
+            continue
+        opened += 1
+        uri = f"file://{path}"
+        events.append({"time": clock, "message": {"method": "open", "params": {
+            "uri": uri, "path": path, "version": 0, "text": "".join(lines),
+        }}})
+        version = 0
+        for row in sorted(rnd.sample(rows, min(lines_per_file, len(rows)))):
+            typed, version, clock = retype_line(uri, lines, row, version, clock)
+            events += typed
+        events.append({"time": clock, "message": {"method": "close", "params": {"uri": uri}}})
+    return events
+
+
+def load_session(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def prepare_timer():
+    """Function timing QsciAPIs.prepare() of a list of names in ms, None without PyQt5"""
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    try:
+        from PyQt5.QtCore import QEventLoop
+        from PyQt5.QtWidgets import QApplication
+        from PyQt5.Qsci import QsciAPIs, QsciLexerPython
+    except ImportError:
+        return None
+    app = QApplication.instance() or QApplication([])
+    lexer = QsciLexerPython()
+
+    def prepare(names: list) -> float:
+        api = QsciAPIs(lexer)
+        for name in names:
+            api.add(name)
+        loop = QEventLoop()
+        # delivered through the event loop, so it can't fire before exec_
+        api.apiPreparationFinished.connect(loop.quit)
+        start = time.perf_counter()
+        api.prepare()
+        loop.exec_()
+        elapsed = time.perf_counter() - start
+        lexer.setAPIs(None)
+        api.deleteLater()
+        app.processEvents()
+        return elapsed * 1000
+
+    return prepare
+
+
+def replay(events: list, realtime: bool, prepare) -> tuple:
+    """Send a session to a new server, returns (samples, cold samples, failed requests)"""
+    server = subprocess.Popen([sys.executable, SERVER_PATH, "--memory-cap", "0"],
+                              stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    samples, cold = [], []
+    completed = set()
+    failed = 0
+    next_id = 1
+    started = time.perf_counter()
+    try:
+        for event in events:
+            message = event["message"]
+            method = message.get("method")
+            is_request = "id" in message
+            if (method != "complete") if is_request else (method not in REPLAYED_NOTIFICATIONS):
+                continue
+            if realtime:
+                delay = event["time"] - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            out = {"jsonrpc": "2.0", "method": method, "params": message["params"]}
+            if is_request:
+                out["id"] = next_id
+                next_id += 1
+            sent = time.perf_counter()
+            server.stdin.write(json.dumps(out).encode("utf-8") + b"\n")
+            server.stdin.flush()
+            if not is_request:
+                continue
+
+            # one completion in flight at a time, like the editor
+            while True:
+                response = json.loads(server.stdout.readline())
+                if response.get("id") == out["id"]:
+                    break
+            received = time.perf_counter()
+            result = response.get("result")
+            if result is None:
+                failed += 1
+                continue
+            sample = dict(result.get("timings", {}))
+            sample["round_trip"] = (received - sent) * 1000
+            if prepare is not None:
+                sample["prepare"] = prepare(result["names"])
+            sample["total"] = sample["round_trip"] + sample.get("prepare", 0)
+            uri = message["params"]["uri"]
+            (samples if uri in completed else cold).append(sample)
+            completed.add(uri)
+    finally:
+        server.stdin.write(b'{"jsonrpc": "2.0", "method": "exit", "params": {}}\n')
+        server.stdin.close()
+        server.wait()
+    return samples, cold, failed
+
+
+def distribution(samples: list) -> dict:
+    stages = [s for s in COMPLETION_STAGES + ("round_trip",) if any(s in sample for sample in samples)]
+    result = {}
+    for stage in stages:
+        values = [sample[stage] for sample in samples if stage in sample]
+        result[stage] = {
+            "p50": round(percentile(values, 50), 2),
+            "p90": round(percentile(values, 90), 2),
+            "p95": round(percentile(values, 95), 2),
+            "p99": round(percentile(values, 99), 2),
+            "max": round(max(values), 2),
+            "mean": round(sum(values) / len(values), 2),
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--session", action="append", help="session log recorded with ZRAX_SESSION_LOG")
+    parser.add_argument("--path", action="append",
+                        help="project to make a session from (default: the editor sources)")
+    parser.add_argument("--files", type=int, default=10, help="files of a made up session")
+    parser.add_argument("--lines", type=int, default=5, help="lines retyped per file")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save-session", help="write the made up session here, to replay it later")
+    parser.add_argument("--realtime", action="store_true", help="keep the pauses between the recorded messages")
+    parser.add_argument("--no-prepare", action="store_true", help="don't time QsciAPIs.prepare()")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    if args.session:
+        sessions = [load_session(path) for path in args.session]
+    else:
+        sessions = [make_session(args.path or [SRC], args.files, args.lines, args.seed)]
+        if args.save_session:
+            with open(args.save_session, "w", encoding="utf-8") as f:
+                for event in sessions[0]:
+                    f.write(json.dumps(event) + "\n")
+
+    prepare = None if args.no_prepare else prepare_timer()
+    samples, cold, failed = [], [], 0
+    for events in sessions:
+        warm, first, errors = replay(events, args.realtime, prepare)
+        samples += warm
+        cold += first
+        failed += errors
+
+    report = {
+        "sessions": len(sessions),
+        "requests": len(samples) + len(cold) + failed,
+        "failed": failed,
+        # the first completion of every document, jedi still has to load its imports
+        "cold": distribution(cold) if cold else {},
+        "warm": distribution(samples) if samples else {},
+    }
+    out = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(out)
+    else:
+        print(out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""Headless benchmark and golden check of the syntax highlighting engine.
+
+Styles the files of benchmarks/lexer_corpus with syntax.style_document (no Qt
+involved) and compares the style runs with lexer_golden.json. Then it times
+the Python language over real Python files and reports the throughput as
+JSON:
+
+    python benchmarks/lexer_bench.py
+    python benchmarks/lexer_bench.py --path ~/projects --repeat 3 --output bench.json
+    python benchmarks/lexer_bench.py --update-golden
+
+The exit status is 1 when a corpus file doesn't match its golden runs.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "src"))
+
+from syntax import PYTHON, StyledText, language_for_suffix, style_document
+
+CORPUS = os.path.join(HERE, "lexer_corpus")
+GOLDEN = os.path.join(HERE, "lexer_golden.json")
+
+
+def line_runs(styled: StyledText) -> list:
+    """One "length:style ..." string per line, readable in diffs of the golden file"""
+    lines = []
+    count = styled.line_count()
+    for line in range(count):
+        first = styled.line_runs[line]
+        last = styled.line_runs[line + 1] if line + 1 < count else len(styled.run_styles)
+        lines.append(" ".join(f"{styled.run_lengths[i]}:{styled.run_styles[i]}" for i in range(first, last)))
+    return lines
+
+
+def style_corpus() -> dict:
+    """corpus file name -> {"runs": [...], "states": [...]}"""
+    result = {}
+    for name in sorted(os.listdir(CORPUS)):
+        language = language_for_suffix(os.path.splitext(name)[1])
+        if language is None:
+            continue
+        with open(os.path.join(CORPUS, name), "rb") as f:
+            styled = style_document(language, f.read())
+        result[name] = {"language": language.name, "runs": line_runs(styled), "states": list(styled.line_states)}
+    return result
+
+
+def compare(golden: dict, current: dict) -> list:
+    """Human readable differences between two style_corpus results"""
+    problems = []
+    for name in sorted(set(golden) | set(current)):
+        if name not in golden:
+            problems.append(f"{name}: no golden runs, run with --update-golden")
+            continue
+        if name not in current:
+            problems.append(f"{name}: golden runs for a missing file")
+            continue
+        expected, got = golden[name], current[name]
+        for i, (a, b) in enumerate(zip(expected["runs"], got["runs"])):
+            if a != b:
+                problems.append(f"{name}:{i + 1}: expected {a!r}, got {b!r}")
+        for i, (a, b) in enumerate(zip(expected["states"], got["states"])):
+            if a != b:
+                problems.append(f"{name}:{i + 1}: expected end state {a}, got {b}")
+        if len(expected["runs"]) != len(got["runs"]):
+            problems.append(f"{name}: expected {len(expected['runs'])} lines, got {len(got['runs'])}")
+    return problems
+
+
+def python_files(paths: list) -> list:
+    files = []
+    for path in paths:
+        if os.path.isfile(path):
+            files.append(path)
+            continue
+        for d, dirs, names in os.walk(path):
+            dirs[:] = sorted(n for n in dirs if n not in {"__pycache__", ".git", "venv"})
+            files.extend(os.path.join(d, n) for n in sorted(names) if n.endswith(".py"))
+    return files
+
+
+def bench(files: list, repeat: int) -> dict:
+    data = []
+    for path in files:
+        try:
+            with open(path, "rb") as f:
+                data.append(f.read())
+        except OSError:
+            continue
+
+    lines = sum(d.count(b"\n") for d in data)
+    size = sum(len(d) for d in data)
+    # tokens are counted outside the timed loop, with the same combined regex
+    tokens = sum(len(PYTHON.token_re.findall(line)) for d in data
+                 for line in d.decode("utf-8", errors="replace").splitlines())
+
+    best = None
+    runs = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        runs = 0
+        for d in data:
+            runs += len(style_document(PYTHON, d).run_styles)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return {
+        "files": len(data),
+        "lines": lines,
+        "mb": round(size / 1024 / 1024, 2),
+        "tokens": tokens,
+        "style_runs": runs,
+        "seconds": round(best, 4),
+        "tokens_per_s": round(tokens / best) if best else None,
+        "ms_per_10k_lines": round(best * 1000 / lines * 10000, 2) if lines else None,
+        "mb_per_s": round(size / best / 1024 / 1024, 2) if best else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", action="append",
+                        help="python files or directories to time (default: the editor sources and the top level of the stdlib)")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs, the best one is reported")
+    parser.add_argument("--update-golden", action="store_true", help="rewrite lexer_golden.json from the current engine")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    current = style_corpus()
+    if args.update_golden:
+        with open(GOLDEN, "w") as f:
+            json.dump(current, f, indent=1, ensure_ascii=False)
+            f.write("\n")
+        problems = []
+    else:
+        try:
+            with open(GOLDEN) as f:
+                golden = json.load(f)
+        except OSError:
+            golden = {}
+        problems = compare(golden, current)
+
+    stdlib = os.path.dirname(os.__file__)
+    paths = args.path or [os.path.join(HERE, "..", "src")] + [
+        os.path.join(stdlib, n) for n in sorted(os.listdir(stdlib)) if n.endswith(".py")
+    ]
+    report = {
+        "golden": {"files": len(current), "mismatches": problems},
+        "python": bench(python_files(paths), args.repeat),
+    }
+
+    out = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(out)
+    else:
+        print(out)
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
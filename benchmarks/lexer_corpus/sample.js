@@ -0,0 +1,17 @@
+/* block comment
+   over lines */
+import { thing } from "./module.js";
+
+class Widget extends Base {
+  constructor(name) {
+    super();
+    this.name = name; // line comment
+  }
+}
+
+function render(items) {
+  const html = `<ul>
+${items.map((i) => "<li>" + i + "</li>").join("")}
+</ul>`;
+  return console.log(html, 'done', 42, null);
+}
@@ -0,0 +1,39 @@
+"""Module docstring with 'single' and "double" quotes inside.
+
+It spans lines and contains ''' which must not end it.
+"""
+import re
+
+PLAIN = "double" + 'single' + "it's" + 'say "hi"'
+ESCAPED = "a \"quoted\" word" + 'it\'s' + "ends with backslash \\"
+EMPTY = "" + '' + """""" + ''''''
+RAW = r"\d+\s*" + R'\w' + rb"\x00" + Rb'raw bytes'
+BYTES = b"bytes" + B'BYTES'
+
+
+def greet(name: str, count: int = 1) -> str:
+    '''Single quoted docstring
+    with "double quotes" and a """ sequence inside.
+    '''
+    text = f"hello {name}, {count + 1} times"
+    nested = f"{name!r:>10} and {'inner'} and {{braces}}"
+    multi = f"""first {name}
+    second {count}
+    """
+    return text + nested + multi
+
+
+PATTERN = re.compile(r"""
+    (?P<key>\w+)   # a key
+    \s*=\s*
+    (?P<value>.*)  # the value
+""", re.VERBOSE)
+
+SQL = '''
+SELECT *  -- not a python comment
+FROM table # not one either
+'''
+
+continued = "line one" \
+    "line two"
+after = 'back to normal'  # a real comment with "quotes"
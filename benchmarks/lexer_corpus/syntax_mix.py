@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from dataclasses import dataclass
+from typing import Dict, List
+
+
+@dataclass
+class Point(object):
+    x: float = 0.0
+    y: float = 1e-3
+
+    def distance(self, other: "Point") -> float:
+        return ((self.x - other.x) ** 2 + (self.y - other.y) ** 2) ** 0.5
+
+
+class Empty: pass
+
+
+def café(valeur=0x1F, *args, **kwargs):
+    résultat = [i * 2 for i in range(10) if i % 3]
+    lookup: Dict[str, List[int]] = {"a": [1, 2], 'b': []}
+    if valeur is None or not résultat:
+        raise ValueError("bad value")
+    while True:
+        break
+    lambda_ = lambda a, b=2: a + b
+    print(len(résultat), sorted(lookup), lambda_(1))
+    return Point(1, 2).distance(Point())
+
+
+async def fetch(url):
+    async with open(url) as f:
+        return await f.read()
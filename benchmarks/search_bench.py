@@ -0,0 +1,191 @@
+"""Headless benchmark of the project search engine.
+
+Generates a synthetic tree and runs SearchWorker.search over it, reporting
+throughput, time to first result and peak memory as JSON:
+
+    python benchmarks/search_bench.py --small-files 20000 --huge-files 2 --output bench.json
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+from fuzzy_searcher import CancelToken, SearchWorker
+
+WORDS = [
+    "def", "class", "return", "import", "self", "value", "items", "search",
+    "index", "path", "editor", "lexer", "token", "result", "window", "None",
+]
+NEEDLE = "zrax_needle"
+QUERIES = ["search", NEEDLE, r"def \w+_\d+\(", "return None"]
+
+
+def text_line(rnd: random.Random, needle_rate: float) -> str:
+    words = [rnd.choice(WORDS) for _ in range(rnd.randint(3, 12))]
+    if rnd.random() < needle_rate:
+        words.insert(rnd.randrange(len(words)), NEEDLE)
+    return "    " * rnd.randint(0, 3) + " ".join(words) + "\n"
+
+
+def write_text_file(path: str, size: int, rnd: random.Random, needle_rate: float, encoding="utf8"):
+    written = 0
+    with open(path, "w", encoding=encoding) as f:
+        while written < size:
+            line = text_line(rnd, needle_rate)
+            f.write(line)
+            written += len(line)
+
+
+def generate_corpus(root: str, small_files: int, small_size: int, huge_files: int, huge_size: int,
+                    depth: int, binary_files: int, latin1_files: int, seed: int = 0):
+    """Fill `root` with a synthetic tree, returns (file count, total bytes)"""
+    rnd = random.Random(seed)
+
+    dirs = [root]
+    for i in range(max(1, small_files // 100)):
+        d = rnd.choice(dirs)
+        if d.count(os.sep) - root.count(os.sep) < depth:
+            d = os.path.join(d, f"pkg_{i}")
+            os.makedirs(d, exist_ok=True)
+            dirs.append(d)
+    # one deep chain regardless of the random layout
+    deep = root
+    for i in range(depth):
+        deep = os.path.join(deep, f"level_{i}")
+    os.makedirs(deep, exist_ok=True)
+    dirs.append(deep)
+
+    for i in range(small_files):
+        write_text_file(os.path.join(rnd.choice(dirs), f"module_{i}.py"), rnd.randint(small_size // 2, small_size * 2), rnd, 0.001)
+    for i in range(huge_files):
+        write_text_file(os.path.join(root, f"generated_{i}.log"), huge_size, rnd, 0.0001)
+    for i in range(latin1_files):
+        path = os.path.join(rnd.choice(dirs), f"legacy_{i}.txt")
+        write_text_file(path, small_size, rnd, 0.001, encoding="latin-1")
+        with open(path, "a", encoding="latin-1") as f:
+            f.write("caf\xe9 " + NEEDLE + "\n")
+    for i in range(binary_files):
+        with open(os.path.join(rnd.choice(dirs), f"blob_{i}.bin"), "wb") as f:
+            f.write(b"\0" + rnd.randbytes(small_size * 4))
+
+    return corpus_size(root)
+
+
+def corpus_size(root: str):
+    count = 0
+    total = 0
+    for d, _, files in os.walk(root):
+        for f in files:
+            count += 1
+            total += os.path.getsize(os.path.join(d, f))
+    return count, total
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return {"self": round(own / scale, 1), "children": round(children / scale, 1)}
+
+
+def run_query(worker: SearchWorker, root: str, pattern: str, file_count: int, total_bytes: int) -> dict:
+    first = []
+    start = time.perf_counter()
+
+    def on_results(_, batch):
+        if not first:
+            first.append(time.perf_counter() - start)
+
+    worker.results.connect(on_results)
+    worker.search_text = pattern
+    worker.search_path = root
+    worker.search_project = True
+    worker.search(1, CancelToken())
+    elapsed = time.perf_counter() - start
+    worker.results.disconnect(on_results)
+
+    return {
+        "pattern": pattern,
+        "hits": worker.count,
+        "seconds": round(elapsed, 4),
+        "files_per_s": round(file_count / elapsed, 1),
+        "mb_per_s": round(total_bytes / elapsed / 1024 / 1024, 1),
+        "time_to_first_result": round(first[0], 4) if first else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--small-files", type=int, default=2000)
+    parser.add_argument("--small-size", type=int, default=4096, help="average bytes per small file")
+    parser.add_argument("--huge-files", type=int, default=1)
+    parser.add_argument("--huge-size", type=int, default=64 * 1024 * 1024)
+    parser.add_argument("--depth", type=int, default=12)
+    parser.add_argument("--binary-files", type=int, default=50)
+    parser.add_argument("--latin1-files", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=2, help="runs per query, the first one builds the index")
+    parser.add_argument("--corpus", help="reuse/keep the corpus in this directory")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    root = args.corpus or tempfile.mkdtemp(prefix="zrax-bench-")
+    cache = tempfile.mkdtemp(prefix="zrax-bench-cache-")
+    os.environ["XDG_CACHE_HOME"] = cache
+    try:
+        t = time.perf_counter()
+        if args.corpus and os.listdir(root):
+            file_count, total_bytes = corpus_size(root)
+        else:
+            file_count, total_bytes = generate_corpus(
+                root, args.small_files, args.small_size, args.huge_files, args.huge_size,
+                args.depth, args.binary_files, args.latin1_files, args.seed
+            )
+        generate_seconds = time.perf_counter() - t
+
+        worker = SearchWorker()
+        runs = []
+        for pattern in QUERIES:
+            for i in range(args.repeat):
+                result = run_query(worker, root, pattern, file_count, total_bytes)
+                result["run"] = i
+                runs.append(result)
+        worker.scanner.shutdown()
+
+        report = {
+            "corpus": {
+                "files": file_count,
+                "mb": round(total_bytes / 1024 / 1024, 1),
+                "generate_seconds": round(generate_seconds, 2),
+            },
+            "runs": runs,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+    finally:
+        if not args.corpus:
+            shutil.rmtree(root, ignore_errors=True)
+        shutil.rmtree(cache, ignore_errors=True)
+
+    out = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(out)
+    else:
+        print(out)
+
+
+if __name__ == "__main__":
+    main()
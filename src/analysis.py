@@ -0,0 +1,386 @@
+import json
+import os
+import re
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from PyQt5.Qsci import QsciScintilla
+from PyQt5.QtCore import QObject, QProcess, QTimer
+from PyQt5.QtWidgets import QApplication
+
+from analysis_server import CONTENT_MODIFIED, REQUEST_CANCELLED, RESTART_EXIT_CODE
+
+SERVER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "analysis_server.py")
+ANALYSIS_MEMORY_CAP_MB = 1024
+# file the messages sent to the server are appended to, for benchmarks/completion_bench.py
+SESSION_LOG_ENV = "ZRAX_SESSION_LOG"
+# crashes in a row (without a single answer in between) before giving up
+MAX_FAILURES = 3
+# edits kept between two requests before the full text is sent instead
+MAX_PENDING_CHANGES = 1000
+# edits spanning more lines always count as changing definitions
+MAX_DEFINITION_SCAN_LINES = 200
+# go to definition results kept per document
+GOTO_CACHE_SIZE = 64
+# how far up the enclosing def / class lines are looked for
+SCOPE_SCAN_LINES = 1000
+
+DEFINITION_KEYWORD_RE = re.compile(r"\s*(?:@|async\s|def\s|class\s|import\s|from\s|global\s|nonlocal\s)")
+FOR_TARGET_RE = re.compile(r"\s*for\s+(.*?)\s+in\b")
+AS_TARGET_RE = re.compile(r"\bas\s+(\w+)")
+SCOPE_RE = re.compile(r"(?:async\s+)?(?:def|class)\s+(\w+)")
+EXPRESSION_RE = re.compile(r"(?:\w+\s*\.\s*)*\w*$")
+WORD_RE = re.compile(r"^\w*")
+ASSIGNMENT_TARGET_RE = re.compile(r"\s*([\w.,\[\] *]+?)\s*(?::|(?://|\*\*|>>|<<|[-+*/%&|^@])?=(?!=))")
+
+
+def definition_signature(line: str) -> str:
+    """The part of a line that defines names, empty when it defines none"""
+    if DEFINITION_KEYWORD_RE.match(line):
+        return line.strip()
+    parts = AS_TARGET_RE.findall(line)
+    match = FOR_TARGET_RE.match(line) or ASSIGNMENT_TARGET_RE.match(line)
+    if match:
+        parts.append(match.group(1))
+    return " ".join(parts)
+
+
+class AnalysisClient(QObject):
+    """Connection to the analysis server process, shared by every editor.
+
+    Requests are answered through callbacks on the GUI thread. When the
+    server exits, because of its memory cap or a crash, a new one is started,
+    the open documents and prewarmed folders are sent again and the
+    unanswered requests are replayed.
+    """
+
+    _instance: "AnalysisClient" = None
+
+    @classmethod
+    def get(cls) -> "AnalysisClient":
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self):
+        super().__init__()
+        self.next_id = 1
+        # id -> (method, params, callback)
+        self.requests: Dict[int, Tuple[str, dict, Callable[[Any], None]]] = {}
+        # uri -> returns the params of its "open" notification
+        self.documents: Dict[str, Callable[[], dict]] = {}
+        self.roots: List[str] = []
+        # bumped on every save, results cached against it may be out of date
+        self.saves = 0
+        self.buffer = b""
+        self.failures = 0
+        self.stopping = False
+        self.session_log = None
+        if os.environ.get(SESSION_LOG_ENV):
+            try:
+                self.session_log = open(os.environ[SESSION_LOG_ENV], "a", buffering=1, encoding="utf-8")
+            except OSError as e:
+                print(f"Analysis error: {e}")
+        self.started = time.perf_counter()
+
+        self.process = QProcess(self)
+        self.process.setProcessChannelMode(QProcess.ForwardedErrorChannel)
+        self.process.readyReadStandardOutput.connect(self.read_output)
+        self.process.finished.connect(self.process_finished)
+        self.process.errorOccurred.connect(lambda error: print(f"Analysis error: process error {error}"))
+        if QApplication.instance() is not None:
+            QApplication.instance().aboutToQuit.connect(self.shutdown)
+        self.start()
+
+    def start(self):
+        self.buffer = b""
+        self.process.start(sys.executable, [SERVER_PATH, "--memory-cap", str(ANALYSIS_MEMORY_CAP_MB)])
+
+    def gave_up(self) -> bool:
+        return self.failures > MAX_FAILURES
+
+    def send(self, message: dict):
+        if self.gave_up():
+            return
+        message["jsonrpc"] = "2.0"
+        self.process.write(json.dumps(message).encode("utf-8") + b"\n")
+        if self.session_log is not None:
+            # seconds since startup, a replay can keep the pauses between keystrokes
+            record = {"time": round(time.perf_counter() - self.started, 3), "message": message}
+            self.session_log.write(json.dumps(record) + "\n")
+
+    def notify(self, method: str, params: dict):
+        self.send({"method": method, "params": params})
+
+    def request(self, method: str, params: dict, callback: Callable[[Any], None]) -> int:
+        """Send a request, `callback` gets its result or None when it failed"""
+        request_id = self.next_id
+        self.next_id += 1
+        self.requests[request_id] = (method, params, callback)
+        if self.gave_up():
+            # no server to answer it, fails once the caller has the id
+            QTimer.singleShot(0, lambda: self.fail(request_id))
+            return request_id
+        self.send({"id": request_id, "method": method, "params": params})
+        return request_id
+
+    def fail(self, request_id: int):
+        request = self.requests.pop(request_id, None)
+        if request is not None:
+            request[2](None)
+
+    def cancel(self, request_id: int):
+        """Drop a request, its callback won't be called"""
+        if self.requests.pop(request_id, None) is not None:
+            self.notify("$/cancel", {"id": request_id})
+
+    def open_document(self, uri: str, source: Callable[[], dict]):
+        self.documents[uri] = source
+        self.notify("open", source())
+
+    def close_document(self, uri: str):
+        if self.documents.pop(uri, None) is not None:
+            self.notify("close", {"uri": uri})
+
+    def open_folder(self, root: str):
+        """Prewarm jedi for a folder and index its symbols"""
+        root = os.path.abspath(root)
+        if root not in self.roots:
+            self.roots.append(root)
+        self.notify("prewarm", {"root": root})
+        self.notify("index", {"root": root})
+
+    def file_saved(self, path: str):
+        self.saves += 1
+        self.notify("saved", {"path": os.path.abspath(path)})
+
+    def read_output(self):
+        self.buffer += self.process.readAllStandardOutput().data()
+        *lines, self.buffer = self.buffer.split(b"\n")
+        for line in lines:
+            try:
+                message = json.loads(line)
+            except ValueError as err:
+                print(f"Analysis error: {err}")
+                continue
+            self.failures = 0
+            request = self.requests.pop(message.get("id"), None)
+            if request is None:
+                continue
+            method, _, callback = request
+            error = message.get("error")
+            if error is not None:
+                if error["code"] not in (REQUEST_CANCELLED, CONTENT_MODIFIED):
+                    print(f"Analysis error: {method}: {error['message']}")
+                callback(None)
+            else:
+                callback(message.get("result"))
+
+    def process_finished(self, exit_code: int, exit_status: QProcess.ExitStatus):
+        if self.stopping:
+            return
+        if exit_status != QProcess.NormalExit or exit_code != RESTART_EXIT_CODE:
+            self.failures += 1
+            print(f"Analysis error: server exited with code {exit_code}")
+        if self.gave_up():
+            print(f"Analysis error: server failed {self.failures} times in a row, giving up")
+            requests, self.requests = self.requests, {}
+            for _, _, callback in requests.values():
+                callback(None)
+            return
+
+        self.start()
+        for source in self.documents.values():
+            self.notify("open", source())
+        for root in self.roots:
+            self.notify("prewarm", {"root": root})
+            self.notify("index", {"root": root})
+        for request_id, (method, params, _) in sorted(self.requests.items()):
+            self.send({"id": request_id, "method": method, "params": params})
+
+    def shutdown(self):
+        self.stopping = True
+        if self.session_log is not None:
+            self.session_log.close()
+            self.session_log = None
+        if self.process.state() != QProcess.NotRunning:
+            self.notify("exit", {})
+            self.process.closeWriteChannel()
+            if not self.process.waitForFinished(1000):
+                self.process.kill()
+
+
+class AnalysisDocument:
+    """An editor's document as seen by the analysis server.
+
+    It is opened on the server lazily with the full text. After that the
+    edits are recorded from Scintilla's modification notifications and only
+    those are sent before the next request, so a request costs the same in a
+    small and a huge file.
+
+    `definitions_version` only changes with edits that add, remove or rename
+    definitions, results cached against it stay valid while the user types
+    anything else.
+    """
+
+    def __init__(self, path: str, editor: QsciScintilla):
+        self.client = AnalysisClient.get()
+        self.path = path or None
+        self.uri = self.uri_for(self.path)
+        self.editor = editor
+        self.version = 0
+        self.opened = False
+        # (start, end, inserted utf-8) in document bytes, applied in order;
+        # None when the full text has to be sent again
+        self.changes: Optional[List[Tuple[int, int, bytes]]] = []
+        self.definitions_version = 0
+        self.definitions_before: Optional[List[str]] = None
+        # (definitions version, saves, scope, dotted name) -> definitions
+        self.goto_cache: "OrderedDict[tuple, list]" = OrderedDict()
+        editor.SCN_MODIFIED.connect(self._text_modified)
+
+    def uri_for(self, path: Optional[str]) -> str:
+        # a file open in two tabs is two documents on the server, closing one keeps the other
+        return f"{path}#{id(self)}" if path else f"untitled:{id(self)}"
+
+    def rename(self, path: str):
+        """The editor now shows `path`, e.g. after Save As"""
+        opened = self.opened
+        self.close()
+        self.path = path or None
+        self.uri = self.uri_for(self.path)
+        # definitions were looked up relative to the old file
+        self.goto_cache.clear()
+        if opened:
+            self.sync()
+
+    def open_params(self) -> dict:
+        # the full text includes every edit recorded so far
+        self.changes = []
+        return {"uri": self.uri, "path": self.path, "version": self.version, "text": self.editor.text()}
+
+    def _text_modified(self, position, modification_type, text, length, *args):
+        if modification_type & QsciScintilla.SC_MOD_BEFOREINSERT:
+            self.definitions_before = self.definitions(position, 0)
+        elif modification_type & QsciScintilla.SC_MOD_BEFOREDELETE:
+            self.definitions_before = self.definitions(position, length)
+        elif modification_type & (QsciScintilla.SC_MOD_INSERTTEXT | QsciScintilla.SC_MOD_DELETETEXT):
+            inserted = length if modification_type & QsciScintilla.SC_MOD_INSERTTEXT else 0
+            after = self.definitions(position, inserted)
+            if after is None or self.definitions_before is None or after != self.definitions_before:
+                self.definitions_version += 1
+            self.definitions_before = None
+
+        if not self.opened or self.changes is None:
+            return
+        if modification_type & QsciScintilla.SC_MOD_INSERTTEXT:
+            # the text argument isn't null terminated, read it from the document
+            inserted = self.editor.bytes(position, position + length).data()[:length]
+            self.record(position, position, inserted)
+        elif modification_type & QsciScintilla.SC_MOD_DELETETEXT:
+            self.record(position, position + length, b"")
+
+    def definitions(self, position: int, length: int) -> Optional[List[str]]:
+        """Definition signatures of the lines of a range, None when it's too long to check"""
+        first = self.editor.SendScintilla(QsciScintilla.SCI_LINEFROMPOSITION, position)
+        last = self.editor.SendScintilla(QsciScintilla.SCI_LINEFROMPOSITION, position + length)
+        if last - first > MAX_DEFINITION_SCAN_LINES:
+            return None
+        signatures = (definition_signature(self.editor.text(line)) for line in range(first, last + 1))
+        return [signature for signature in signatures if signature]
+
+    def record(self, start: int, end: int, inserted: bytes):
+        changes = self.changes
+        if changes:
+            # merge typing and backspacing into the previous change
+            last_start, last_end, last_text = changes[-1]
+            if start == end and start == last_start + len(last_text):
+                changes[-1] = (last_start, last_end, last_text + inserted)
+                return
+            if not inserted and not last_text and end == last_start:
+                changes[-1] = (start, last_end, b"")
+                return
+            if not inserted and not last_text and start == last_start:
+                changes[-1] = (last_start, last_end + end - start, b"")
+                return
+            if not inserted and last_start <= start and end == last_start + len(last_text):
+                changes[-1] = (last_start, last_end, last_text[:start - last_start])
+                return
+        changes.append((start, end, inserted))
+        if len(changes) > MAX_PENDING_CHANGES:
+            self.changes = None
+
+    def sync(self):
+        if not self.opened:
+            self.opened = True
+            self.client.open_document(self.uri, self.open_params)
+            return
+        if self.changes is None:
+            changes = [{"text": self.editor.text()}]
+        elif self.changes:
+            changes = [
+                {"start": start, "end": end, "text": text.decode("utf-8", errors="surrogateescape")}
+                for start, end, text in self.changes
+            ]
+        else:
+            return
+        self.changes = []
+        self.version += 1
+        self.client.notify("change", {"uri": self.uri, "version": self.version, "changes": changes})
+
+    def request(self, method: str, line: int, column: int, callback: Callable[[Any], None]) -> int:
+        """A request at (1 based line, column) of the current text"""
+        self.sync()
+        params = {"uri": self.uri, "version": self.version, "line": line, "column": column}
+        return self.client.request(method, params, callback)
+
+    def goto(self, line: int, column: int, callback: Callable[[Any], None]) -> Optional[int]:
+        """Definitions of the name at (1 based line, column).
+
+        Answered right away from the cache when the same name was looked up
+        in the same scope and nothing was defined or saved since, returns
+        the request id otherwise.
+        """
+        text = self.editor.text(line - 1)
+        expression = EXPRESSION_RE.search(text[:column]).group() + WORD_RE.search(text[column:]).group()
+        key = (self.definitions_version, self.client.saves, self.scope(line - 1), re.sub(r"\s", "", expression))
+        definitions = self.goto_cache.get(key)
+        if definitions is not None:
+            self.goto_cache.move_to_end(key)
+            callback(definitions)
+            return None
+
+        def done(definitions: Optional[list]):
+            if definitions is not None and expression:
+                self.goto_cache[key] = definitions
+                if len(self.goto_cache) > GOTO_CACHE_SIZE:
+                    self.goto_cache.popitem(last=False)
+            callback(definitions)
+
+        return self.request("goto", line, column, done)
+
+    def scope(self, line: int) -> str:
+        """Dotted names of the def / class blocks around a 0 based line"""
+        text = self.editor.text(line)
+        indent = len(text) - len(text.lstrip())
+        names = []
+        for i in range(line - 1, max(line - SCOPE_SCAN_LINES, 0) - 1, -1):
+            text = self.editor.text(i)
+            stripped = text.lstrip()
+            if not stripped or stripped.startswith("#") or len(text) - len(stripped) >= indent:
+                continue
+            indent = len(text) - len(stripped)
+            match = SCOPE_RE.match(stripped)
+            if match:
+                names.append(match.group(1))
+            if indent == 0:
+                break
+        return ".".join(reversed(names))
+
+    def close(self):
+        if self.opened:
+            self.opened = False
+            self.changes = []
+            self.client.close_document(self.uri)
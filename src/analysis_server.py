@@ -0,0 +1,473 @@
+"""Code analysis server, runs jedi outside of the editor process.
+
+Speaks JSON-RPC 2.0 over stdio, one message per line. The editor keeps a
+mirror of every open document here in sync with `open` / `change` / `close`
+notifications, and sends `complete` and `goto` requests with the document
+version they were made for. `complete` results carry the time spent in each
+stage. Requests that are still queued can be dropped
+with `$/cancel`.
+
+The python files of the folders sent with `index` are parsed into a symbol
+index by a background thread, `saved` updates a single file. `goto`
+answers from it when it can, jedi only runs for the rest. `references` and
+`symbols` (fuzzy search of the definitions of every indexed file) only use
+the index.
+
+When the process grows over the memory cap (jedi and parso caches are never
+trimmed) it exits with RESTART_EXIT_CODE after answering the current request,
+and the editor starts a fresh one.
+
+    python analysis_server.py [--memory-cap MB]
+"""
+import argparse
+import ast
+import json
+import os
+import queue
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+import jedi
+from jedi import Script
+from jedi.api.environment import InterpreterEnvironment
+
+from symbol_index import Location, SymbolIndex, binding_count, module_name, tree_symbols
+from walker import Walker
+
+RESTART_EXIT_CODE = 3
+DEFAULT_MEMORY_CAP_MB = 1024
+
+# JSON-RPC error codes
+METHOD_NOT_FOUND = -32601
+INTERNAL_ERROR = -32603
+REQUEST_CANCELLED = -32800
+CONTENT_MODIFIED = -32801
+
+# modules most code imports, loaded into jedi's caches when a folder is opened
+PREWARM_MODULES = [
+    "os", "sys", "re", "json", "typing", "pathlib", "collections",
+    "itertools", "functools", "dataclasses", "subprocess", "logging",
+]
+# the most imported top level modules of the folder are loaded as well
+PREWARM_PROJECT_IMPORTS = 20
+PREWARM_SCAN_FILES = 500
+
+IMPORT_RE = re.compile(r"^\s*(?:from|import)\s+([A-Za-z_]\w*)", re.MULTILINE)
+# dotted names before the one under the cursor
+CHAIN_RE = re.compile(r"(?:\w+\s*\.\s*)*$")
+
+
+def memory_usage() -> int:
+    """Resident memory of this process in bytes, 0 when it can't be read"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    if os.name == "nt":
+        import ctypes
+        from ctypes import wintypes
+
+        class Counters(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + [
+                (name, ctypes.c_size_t) for name in (
+                    "PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage",
+                    "QuotaPagedPoolUsage", "QuotaPeakNonPagedPoolUsage",
+                    "QuotaNonPagedPoolUsage", "PagefileUsage", "PeakPagefileUsage")
+            ]
+
+        counters = Counters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize
+        return 0
+    try:
+        import resource
+        # the peak rather than the current size, good enough for a cap
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    except (ImportError, OSError):
+        return 0
+
+
+class Workspace:
+    """jedi Project and environment of a folder, shared by every request in it.
+
+    Keeping them alive means sys.path is only inferred once, and jedi's module
+    caches stay warm between completions.
+    """
+
+    _instances: Dict[str, "Workspace"] = {}
+
+    @classmethod
+    def get(cls, root: str) -> "Workspace":
+        root = os.path.abspath(root)
+        workspace = cls._instances.get(root)
+        if workspace is None:
+            workspace = cls._instances[root] = cls(root)
+        return workspace
+
+    @classmethod
+    def for_file(cls, path: Optional[str]) -> "Workspace":
+        """The workspace of the deepest opened folder containing `path`"""
+        path = os.path.abspath(path) if path else os.getcwd()
+        roots = [r for r in cls._instances if path == r or path.startswith(r + os.sep)]
+        if roots:
+            return cls.get(max(roots, key=len))
+        return cls.get(os.path.dirname(path) if os.path.isfile(path) else path)
+
+    def __init__(self, root: str):
+        self.root = root
+        self.project = jedi.Project(root)
+        self.environment = self._environment()
+        self.prewarmed = False
+
+    def _environment(self):
+        try:
+            environment = self.project.get_environment()
+            # starts the interpreter subprocess, so a broken one is found now
+            environment.get_sys_path()
+            return environment
+        except Exception as err:
+            print(f"Analysis error: {err}", file=sys.stderr)
+            return InterpreterEnvironment()
+
+    def script(self, text: str, path: Optional[str]) -> Script:
+        return Script(text, path=path or None, project=self.project, environment=self.environment)
+
+    def project_imports(self) -> List[str]:
+        counts = Counter()
+        files = 0
+        for path, _, size in Walker.for_root(self.root).walk():
+            if not path.endswith(".py") or size > 1024 * 1024:
+                continue
+            try:
+                with open(path, "r", encoding="utf8") as f:
+                    counts.update(set(IMPORT_RE.findall(f.read())))
+            except (OSError, UnicodeDecodeError):
+                continue
+            files += 1
+            if files >= PREWARM_SCAN_FILES:
+                break
+        return [name for name, _ in counts.most_common(PREWARM_PROJECT_IMPORTS)]
+
+    def prewarm_modules(self) -> List[str]:
+        """Modules to load into jedi's caches, empty once they were listed"""
+        if self.prewarmed:
+            return []
+        self.prewarmed = True
+        return list(dict.fromkeys(PREWARM_MODULES + self.project_imports()))
+
+    def prewarm(self, module: str):
+        source = f"import {module}\n{module}."
+        self.script(source, None).complete(2, len(module) + 1)
+
+
+class Document:
+    """Mirror of a document open in the editor, kept as utf-8 like Scintilla"""
+
+    def __init__(self, path: Optional[str], version: int, text: str):
+        self.path = path
+        self.version = version
+        self.data = bytearray(text.encode("utf-8"))
+
+    def apply(self, version: int, changes: List[dict]):
+        for change in changes:
+            if "start" in change:
+                # surrogates stand for bytes of a character split by the edit
+                self.data[change["start"]:change["end"]] = change["text"].encode("utf-8", errors="surrogateescape")
+            else:
+                self.data = bytearray(change["text"].encode("utf-8"))
+        self.version = version
+
+    def text(self) -> str:
+        return self.data.decode("utf-8", errors="replace")
+
+
+def word_at(line_text: str, column: int) -> Tuple[int, str]:
+    """(start, identifier) around a column of a line"""
+    start = end = min(column, len(line_text))
+    while start > 0 and (line_text[start - 1].isalnum() or line_text[start - 1] == "_"):
+        start -= 1
+    while end < len(line_text) and (line_text[end].isalnum() or line_text[end] == "_"):
+        end += 1
+    return start, line_text[start:end]
+
+
+class Indexer(threading.Thread):
+    """Fills the symbol index of the opened folders and updates saved files"""
+
+    def __init__(self, index: SymbolIndex):
+        super().__init__(daemon=True)
+        self.index = index
+        # ("root" | "file", path)
+        self.jobs: "queue.Queue[Tuple[str, str]]" = queue.Queue()
+
+    def run(self):
+        while True:
+            kind, path = self.jobs.get()
+            try:
+                if kind == "root":
+                    self.index.index_root(path)
+                else:
+                    self.index.update_file(path)
+                if self.jobs.empty() and self.index.finder_dirty:
+                    self.index.build_finder()
+            except Exception as err:
+                print(f"Analysis error: indexing {path}: {err}", file=sys.stderr)
+
+
+class RequestError(Exception):
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+
+
+class Server:
+    def __init__(self, memory_cap: int):
+        self.memory_cap = memory_cap
+        self.documents: Dict[str, Document] = {}
+        # (arrival time, message), None at the end of the input
+        self.messages: "queue.Queue[Optional[Tuple[float, dict]]]" = queue.Queue()
+        # seconds the request being handled waited in the queue
+        self.queue_wait = 0.0
+        self.cancelled = set()
+        self.cancelled_lock = threading.Lock()
+        # (workspace, module), loaded one at a time while no request is queued
+        self.warmups: Deque[Tuple[Workspace, str]] = deque()
+        self.index = SymbolIndex()
+        self.indexer = Indexer(self.index)
+
+        # jedi or the analysed code may print, stdout only carries messages
+        self.output = sys.stdout.buffer
+        sys.stdout = sys.stderr
+
+    def read_input(self):
+        for line in sys.stdin.buffer:
+            try:
+                message = json.loads(line)
+            except ValueError as err:
+                print(f"Analysis error: {err}", file=sys.stderr)
+                continue
+            if message.get("method") == "$/cancel":
+                # handled here, the queue may hold the request behind slow ones
+                with self.cancelled_lock:
+                    self.cancelled.add(message["params"]["id"])
+                continue
+            self.messages.put((time.perf_counter(), message))
+        self.messages.put(None)
+
+    def send(self, message: dict):
+        message["jsonrpc"] = "2.0"
+        self.output.write(json.dumps(message).encode("utf-8") + b"\n")
+        self.output.flush()
+
+    def serve(self):
+        threading.Thread(target=self.read_input, daemon=True).start()
+        self.indexer.start()
+        while True:
+            try:
+                item = self.messages.get(block=not self.warmups)
+            except queue.Empty:
+                self.warm_up()
+                continue
+            if item is None or item[1].get("method") == "exit":
+                return 0
+            received, message = item
+            self.queue_wait = time.perf_counter() - received
+            self.handle(message)
+            if self.memory_cap and memory_usage() > self.memory_cap:
+                print("Analysis server over the memory cap, restarting", file=sys.stderr)
+                return RESTART_EXIT_CODE
+
+    def warm_up(self):
+        workspace, module = self.warmups.popleft()
+        try:
+            workspace.prewarm(module)
+        except Exception as err:
+            print(f"Analysis error: {err}", file=sys.stderr)
+
+    def handle(self, message: dict):
+        request_id = message.get("id")
+        method = message.get("method")
+        params = message.get("params", {})
+        if request_id is None:
+            try:
+                self.notification(method, params)
+            except Exception as err:
+                print(f"Analysis error: {method}: {err}", file=sys.stderr)
+            return
+
+        with self.cancelled_lock:
+            cancelled = request_id in self.cancelled
+            self.cancelled.discard(request_id)
+        try:
+            if cancelled:
+                raise RequestError(REQUEST_CANCELLED, "cancelled")
+            handler = getattr(self, f"request_{method}", None)
+            if handler is None:
+                raise RequestError(METHOD_NOT_FOUND, f"unknown method {method}")
+            self.send({"id": request_id, "result": handler(params)})
+        except RequestError as err:
+            self.send({"id": request_id, "error": {"code": err.code, "message": str(err)}})
+        except Exception as err:
+            self.send({"id": request_id, "error": {"code": INTERNAL_ERROR, "message": str(err)}})
+
+    def notification(self, method: str, params: dict):
+        if method == "open":
+            self.documents[params["uri"]] = Document(params.get("path"), params["version"], params["text"])
+        elif method == "change":
+            self.documents[params["uri"]].apply(params["version"], params["changes"])
+        elif method == "close":
+            self.documents.pop(params["uri"], None)
+        elif method == "prewarm":
+            workspace = Workspace.get(params["root"])
+            self.warmups.extend((workspace, module) for module in workspace.prewarm_modules())
+        elif method == "index":
+            self.indexer.jobs.put(("root", os.path.abspath(params["root"])))
+        elif method == "saved":
+            self.indexer.jobs.put(("file", os.path.abspath(params["path"])))
+        else:
+            print(f"Analysis error: unknown notification {method}", file=sys.stderr)
+
+    def document(self, params: dict) -> Document:
+        document = self.documents.get(params["uri"])
+        if document is None:
+            raise RequestError(INTERNAL_ERROR, f"{params['uri']} is not open")
+        if document.version != params["version"]:
+            raise RequestError(CONTENT_MODIFIED, "document changed")
+        return document
+
+    def script(self, params: dict) -> Script:
+        document = self.document(params)
+        return Workspace.for_file(document.path).script(document.text(), document.path)
+
+    def request_complete(self, params: dict) -> dict:
+        start = time.perf_counter()
+        script = self.script(params)
+        built = time.perf_counter()
+        completions = script.complete(params["line"], params["column"])
+        done = time.perf_counter()
+        return {
+            "names": [c.name for c in completions],
+            # ms spent waiting behind other messages, building the Script and completing
+            "timings": {
+                "queue": round(self.queue_wait * 1000, 2),
+                "script": round((built - start) * 1000, 2),
+                "complete": round((done - built) * 1000, 2),
+            },
+        }
+
+    def indexed_definition(self, document: Document, line: int, column: int) -> Optional[Location]:
+        """Definition of the name at a position from the symbol index, without inference.
+
+        Only module level names are looked up, and only if nothing else in the
+        file binds the same name. Everything else is left to jedi.
+        """
+        text = document.text()
+        lines = text.split("\n")
+        if not 0 < line <= len(lines):
+            return None
+        line_text = lines[line - 1]
+        start, word = word_at(line_text, column)
+        if not word.isidentifier():
+            return None
+        chain = [part.strip() for part in CHAIN_RE.search(line_text[:start]).group().split(".")[:-1]]
+        names = chain + [word]
+
+        path = document.path and os.path.abspath(document.path)
+        root = path and self.index.root_of(path)
+        module = module_name(root, path) if root else ""
+        try:
+            tree = ast.parse(text)
+        except (SyntaxError, ValueError, RecursionError):
+            return None
+        if binding_count(tree, names[0]) != 1:
+            return None
+        symbols = {s.name: s for s in tree_symbols(tree, module, path is not None and path.endswith("__init__.py"))}
+        symbol = symbols.get(names[0])
+        if symbol is None:
+            return None
+        if symbol.kind != "import":
+            local = symbols.get(".".join(names))
+            return (path, local.line, local.column) if local and path else None
+        if symbol.target is not None:
+            return self.index.lookup(symbol.module, ".".join([symbol.target] + names[1:]), path)
+        if len(names) == 1:
+            return self.index.module_location(symbol.module, path)
+        # attributes of an imported module: a submodule or a Class.member
+        return (self.index.lookup(".".join([symbol.module] + names[1:-1]), names[-1], path)
+                or self.index.lookup(symbol.module, ".".join(names[1:]), path))
+
+    def request_goto(self, params: dict) -> list:
+        location = self.indexed_definition(self.document(params), params["line"], params["column"])
+        if location is not None:
+            path, line, column = location
+            return [{"path": path, "line": line, "column": column}]
+        definitions = self.script(params).goto(params["line"], params["column"])
+        return [
+            {"path": str(d.module_path) if d.module_path else None, "line": d.line, "column": d.column}
+            for d in definitions
+        ]
+
+    def request_references(self, params: dict) -> list:
+        """Indexed uses of the name at a position, with the text of their lines"""
+        document = self.document(params)
+        lines = document.text().split("\n")
+        line, column = params["line"], params["column"]
+        word = word_at(lines[line - 1], column)[1] if 0 < line <= len(lines) else ""
+        if not word.isidentifier():
+            return []
+        definition = self.indexed_definition(document, line, column)
+        if definition is None:
+            for d in self.script(params).goto(line, column, follow_imports=True):
+                if d.module_path and d.line:
+                    definition = (os.path.abspath(str(d.module_path)), d.line, d.column)
+                    break
+        if definition is None:
+            return []
+        texts: Dict[str, List[str]] = {}
+        references = []
+        for path, ref_line, ref_column in self.index.references(word, definition):
+            if path not in texts:
+                texts[path] = self.file_lines(path)
+            file_lines = texts[path]
+            text = file_lines[ref_line - 1] if ref_line <= len(file_lines) else ""
+            references.append({"path": path, "line": ref_line, "column": ref_column, "text": text})
+        return references
+
+    @staticmethod
+    def file_lines(path: str) -> List[str]:
+        # the saved text, the positions of the index come from it
+        try:
+            with open(path, "rb") as f:
+                return f.read().decode("utf-8", errors="replace").split("\n")
+        except OSError:
+            return []
+
+    def request_symbols(self, params: dict) -> list:
+        """Indexed definitions best matching a fuzzy query"""
+        return [
+            {"name": name, "kind": kind, "path": path, "line": line, "column": column}
+            for name, kind, path, line, column in self.index.search(params["query"], params.get("limit", 50))
+        ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--memory-cap", type=int, default=DEFAULT_MEMORY_CAP_MB,
+                        help="restart above this resident size in MB, 0 to disable")
+    args = parser.parse_args()
+    code = Server(args.memory_cap * 1024 * 1024).serve()
+    sys.stderr.flush()
+    # the stdin reader thread may be blocked in a read, don't wait for it
+    os._exit(code)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,38 +1,198 @@
-from PyQt5.QtCore import QThread, pyqtSignal
-from PyQt5.Qsci import QsciAPIs
-from jedi import Script
-from jedi.api import Completion
-from typing import List
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
 
-class AutoCompleter(QThread):
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+from PyQt5.Qsci import QsciAPIs, QsciLexer
+
+from analysis import AnalysisDocument
+from latency import LatencyStats
+
+# typing pause before a completion request is sent
+COMPLETION_DEBOUNCE_MS = 150
+# completion contexts kept per editor, each one with its prepared QsciAPIs
+COMPLETION_CACHE_SIZE = 32
+
+PREFIX_RE = re.compile(r"\w*$")
+IMPORT_LINE_RE = re.compile(r"\s*(?:import|from)\s")
+
+# (definitions version, saves, scope, trigger context)
+CacheKey = Tuple[int, int, str, str]
+
+
+class CompletionCache:
+    """LRU of the QsciAPIs prepared from the completion list of each context"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.entries: "OrderedDict[CacheKey, QsciAPIs]" = OrderedDict()
+
+    def get(self, key: CacheKey) -> Optional[QsciAPIs]:
+        api = self.entries.get(key)
+        if api is not None:
+            self.entries.move_to_end(key)
+        return api
+
+    def put(self, key: CacheKey, api: QsciAPIs) -> List[QsciAPIs]:
+        """Add an entry, returns the APIs of the evicted ones"""
+        evicted = []
+        old = self.entries.pop(key, None)
+        if old is not None and old is not api:
+            evicted.append(old)
+        self.entries[key] = api
+        while len(self.entries) > self.size:
+            _, old = self.entries.popitem(last=False)
+            evicted.append(old)
+        return evicted
+
+    def clear(self) -> List[QsciAPIs]:
+        evicted = list(self.entries.values())
+        self.entries.clear()
+        return evicted
+
+
+class AutoCompleter(QObject):
+    """Completion scheduler of one editor.
+
+    Completions are cached per (definitions version, scope, trigger
+    context), the trigger context being the text before the identifier that
+    is typed. The analysis server is asked for every name of a context once,
+    typing more of the identifier only narrows the cached list and reuses
+    the QsciAPIs prepared from it. New contexts are debounced.
+
+    One request is in flight, a request for another context cancels it.
+    Results are only shown while the cursor is still in the context they
+    were asked for, otherwise they just go into the cache.
+    """
+    # completions of the latest request are in the lexer's APIs
     finished = pyqtSignal()
+    # a request went through the whole pipeline, its timings are in LatencyStats
+    timed = pyqtSignal()
 
-    def __init__(self, file_path: str, api: QsciAPIs):
+    def __init__(self, document: AnalysisDocument, lexer: QsciLexer):
         super().__init__()
-        self.file_path = file_path
-        self.script: Script = None
-        self.api: QsciAPIs = api
-        self.completions: List[Completion] = None
+        self.document = document
+        self.lexer = lexer
         self.line = 0
         self.index = 0
-        self.text = ""
-
-    def run(self):
-        try:
-            self.script = Script(self.text, path=self.file_path)
-            self.completions = self.script.complete(self.line, self.index)
-            self.load_autocomplete(self.completions)
-        except Exception as err:
-            print(f"AutoCompleter error: {err}")
-            self.finished.emit()
+        self.key: CacheKey = None
+        # the latest request asked for the list to be shown (ctrl+space)
+        self.explicit = False
+
+        self.cache = CompletionCache(COMPLETION_CACHE_SIZE)
+        # (definitions version, saves) the cached completions were asked at
+        self.cache_version = (document.definitions_version, document.client.saves)
+        self.api: QsciAPIs = None
 
-    def load_autocomplete(self, completions: List[Completion]):
-        self.api.clear()
-        [self.api.add(i.name) for i in completions]
-        self.api.prepare()
+        self.request_id: int = None
+        self.request_key: CacheKey = None
 
-    def get_completions(self, line: int, index: int, text: str):
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(COMPLETION_DEBOUNCE_MS)
+        self.timer.timeout.connect(self.submit)
+
+    def context(self, line: int, index: int) -> Tuple[str, str]:
+        """(trigger context, identifier prefix) at a 0 based position"""
+        before = self.document.editor.text(line)[:index]
+        prefix = PREFIX_RE.search(before).group()
+        rest = before[:len(before) - len(prefix)].strip()
+        if rest.endswith(".") or IMPORT_LINE_RE.match(before) or rest.count("(") > rest.count(")"):
+            # attributes, imported names and keyword arguments depend on the text
+            return rest, prefix
+        # plain names only differ between statement and expression positions
+        return ("" if not rest else "expression"), prefix
+
+    def request(self, line: int, index: int, explicit: bool = False):
+        """Complete at (1 based line, column), explicit requests skip the debounce"""
+        self.explicit = explicit
+        version = (self.document.definitions_version, self.document.client.saves)
+        if version != self.cache_version:
+            # a saved module may define other names now
+            self.cache_version = version
+            self.discard(self.cache.clear())
+
+        trigger, prefix = self.context(line - 1, index)
         self.line = line
-        self.index = index
-        self.text = text
-        self.start()
+        # asked at the start of the identifier, for every name of the context
+        self.index = index - len(prefix)
+        self.key = (*self.cache_version, self.document.scope(line - 1), trigger)
+
+        api = self.cache.get(self.key)
+        if api is not None:
+            self.timer.stop()
+            self.drop_request()
+            self.use(api)
+        elif self.request_id is not None and self.request_key == self.key:
+            # the request in flight answers this one as well
+            self.timer.stop()
+        elif explicit:
+            self.timer.stop()
+            self.submit()
+        else:
+            self.timer.start()
+
+    def submit(self):
+        self.drop_request()
+        key = self.request_key = self.key
+        sent = time.perf_counter()
+        self.request_id = self.document.request(
+            "complete", self.line, self.index, lambda result: self.load_results(key, result, sent))
+
+    def drop_request(self):
+        if self.request_id is not None:
+            self.document.client.cancel(self.request_id)
+            self.request_id = None
+
+    def cancel(self):
+        self.key = None
+        self.timer.stop()
+        self.drop_request()
+
+    def load_results(self, key: CacheKey, result: Optional[dict], sent: float):
+        self.request_id = None
+        if result is None:
+            return
+        api = self.load_autocomplete(result["names"], dict(result.get("timings", {})), sent)
+        # a key of older definitions is never looked up again, LRU drops it
+        self.discard(self.cache.put(key, api))
+        if key == self.key:
+            self.use(api)
+
+    def use(self, api: QsciAPIs):
+        # the APIs list narrows itself to the typed prefix when it is shown
+        if api is not self.api:
+            self.api = api
+            self.lexer.setAPIs(api)
+        if api.property("prepared"):
+            self.finished.emit()
+
+    def discard(self, apis: List[QsciAPIs]):
+        for api in apis:
+            if api is self.api:
+                self.api = None
+                self.lexer.setAPIs(None)
+            api.deleteLater()
+
+    def load_autocomplete(self, names: List[str], timings: Dict[str, float], sent: float) -> QsciAPIs:
+        # a new QsciAPIs makes itself the lexer's APIs, use() decides that
+        api = QsciAPIs(self.lexer)
+        self.lexer.setAPIs(self.api)
+        for name in names:
+            api.add(name)
+        started = time.perf_counter()
+        api.apiPreparationFinished.connect(lambda: self.prepared(api, timings, sent, started))
+        api.prepare()
+        return api
+
+    def prepared(self, api: QsciAPIs, timings: Dict[str, float], sent: float, started: float):
+        done = time.perf_counter()
+        timings["prepare"] = (done - started) * 1000
+        timings["total"] = (done - sent) * 1000
+        LatencyStats.get().add_sample(timings)
+        self.timed.emit()
+
+        api.setProperty("prepared", True)
+        if api is self.api:
+            self.finished.emit()
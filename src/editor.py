@@ -2,20 +2,23 @@ from PyQt5.QtWidgets import *
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 from PyQt5.Qsci import *
-from jedi import Script
-from jedi.api import Completion
 import keyword
 import pkgutil
 from pathlib import Path
-from lexer import PyCustomLexer
+from lexer import PyCustomLexer, lexer_for_path, too_big_to_highlight
 from autcompleter import AutoCompleter
+from analysis import AnalysisDocument
 from typing import TYPE_CHECKING, Optional
+import re
 
 if TYPE_CHECKING:
     from main import MainWindow
 
 import resources
 
+# keys that can start or continue a completion
+COMPLETION_TRIGGER_RE = re.compile(r"[\w.]")
+
 class Editor(QsciScintilla):
     def __init__(self, main_window: "MainWindow", parent=None, path: Optional[Path] = None, is_python_file=True):
         super(Editor, self).__init__(parent)
@@ -24,9 +27,9 @@ class Editor(QsciScintilla):
         self.first_launch = True
         self.path: Optional[Path] = path
         self.full_path: str = str(self.path.absolute()) if path else "" # Handle case where path is None
-        self.is_python_file = is_python_file
+        # huge files are edited as plain text, without highlighting or jedi
+        self.is_python_file = is_python_file and not too_big_to_highlight(path)
 
-        self.cursorPositionChanged.connect(self._cusorPositionChanged)
         self.textChanged.connect(self._textChanged)
         self.setContextMenuPolicy(Qt.CustomContextMenu)
         self.customContextMenuRequested.connect(self.show_context_menu)
@@ -60,13 +63,21 @@ class Editor(QsciScintilla):
         if self.is_python_file:
             self.pylexer = PyCustomLexer(self)
             self.pylexer.setDefaultFont(self.window_font)
-            self.__api = QsciAPIs(self.pylexer)
-            self.auto_completer = AutoCompleter(self.full_path, self.__api)
+            self.document = AnalysisDocument(self.full_path, self)
+            self.auto_completer = AutoCompleter(self.document, self.pylexer)
             self.auto_completer.finished.connect(self.loaded_autocomplete)
+            self.auto_completer.timed.connect(self.main_window.show_completion_latency)
+            self.goto_request: Optional[int] = None
+            self.references_request: Optional[int] = None
             self.setLexer(self.pylexer)
         else:
-            self.setPaper(QColor("#1f1f1f"))
-            self.setColor(QColor("#abb2bf"))
+            self.syntax_lexer = lexer_for_path(self.path, self)
+            if self.syntax_lexer is not None:
+                self.syntax_lexer.setDefaultFont(self.window_font)
+                self.setLexer(self.syntax_lexer)
+            else:
+                self.setPaper(QColor("#1f1f1f"))
+                self.setColor(QColor("#abb2bf"))
 
         self.setMarginType(0, QsciScintilla.NumberMargin)
         self.setMarginWidth(0, "000")
@@ -108,8 +119,7 @@ class Editor(QsciScintilla):
         if e.modifiers() == Qt.ControlModifier and e.key() == Qt.Key_Space:
             if self.is_python_file:
                 pos = self.getCursorPosition()
-                self.auto_completer.get_completions(pos[0]+1, pos[1], self.text())
-                self.autoCompleteFromAPIs()
+                self.auto_completer.request(pos[0]+1, pos[1], explicit=True)
             return
 
         if e.modifiers() == Qt.ControlModifier and e.key() == Qt.Key_X: # CUT SHORTCUT
@@ -136,14 +146,32 @@ class Editor(QsciScintilla):
             self.go_to_definition()
             return
 
+        if e.modifiers() == Qt.ShiftModifier and e.key() == Qt.Key_F12:
+            self.find_references()
+            return
+
         super().keyPressEvent(e)
 
-    def _cusorPositionChanged(self, line: int, index: int) -> None:
         if self.is_python_file:
-            self.auto_completer.get_completions(line+1, index, self.text())
+            if COMPLETION_TRIGGER_RE.fullmatch(e.text()) and not self.in_string_or_comment():
+                line, index = self.getCursorPosition()
+                self.auto_completer.request(line + 1, index)
+            elif e.key() not in (Qt.Key_Shift, Qt.Key_Control, Qt.Key_Alt, Qt.Key_Meta):
+                # moving away or deleting makes a pending completion useless
+                self.auto_completer.cancel()
+
+    def in_string_or_comment(self) -> bool:
+        # styles of the text just typed aren't there until the next paint, the
+        # part of the line before the cursor is styled here instead
+        line, index = self.getCursorPosition()
+        state = self.SendScintilla(QsciScintilla.SCI_GETLINESTATE, line - 1) if line > 0 else 0
+        runs, _ = self.pylexer.syntax.style_line(self.text(line)[:index], state)
+        return bool(runs) and runs[-1][1] in (self.pylexer.STRING, self.pylexer.COMMENTS)
 
     def loaded_autocomplete(self):
-        pass
+        if self.auto_completer.explicit:
+            self.auto_completer.explicit = False
+            self.autoCompleteFromAPIs()
 
     def _textChanged(self):
         if not self.current_file_changed and not self.first_launch:
@@ -156,22 +184,60 @@ class Editor(QsciScintilla):
         if self.is_python_file:
             go_to_def_action = menu.addAction("Go to Definition")
             go_to_def_action.triggered.connect(self.go_to_definition)
+            find_refs_action = menu.addAction("Find References")
+            find_refs_action.triggered.connect(self.find_references)
         menu.exec_(self.mapToGlobal(pos))
 
     def go_to_definition(self):
         if not self.is_python_file:
             return
 
+        self.cancel_go_to_definition()
+        line, index = self.getCursorPosition()
+        self.goto_request = self.document.goto(line + 1, index, self.show_definition)
+        if self.goto_request is not None:
+            self.main_window.start_progress("Finding definition...")
+
+    def cancel_go_to_definition(self):
+        if self.goto_request is not None:
+            self.document.client.cancel(self.goto_request)
+            self.goto_request = None
+            self.main_window.stop_progress()
+
+    def find_references(self):
+        if not self.is_python_file:
+            return
+
+        self.cancel_find_references()
         line, index = self.getCursorPosition()
-        script = Script(self.text(), path=str(self.path))
-        try:
-            definitions = script.goto(line + 1, index)
-            if definitions:
-                definition = definitions[0] # added check
-                definition_path = Path(definition.module_path)
-                if definition_path.exists():
-                    self.main_window.set_new_tab(definition_path)
-                    editor: Editor = self.main_window.tab_view.currentWidget()
-                    editor.setCursorPosition(definition.line - 1, definition.column)
-        except Exception as e:
-            QMessageBox.warning(self, "Error", f"Could not find definition: {str(e)}")
+        self.references_request = self.document.request("references", line + 1, index, self.show_references)
+        self.main_window.start_progress("Finding references...")
+
+    def cancel_find_references(self):
+        if self.references_request is not None:
+            self.document.client.cancel(self.references_request)
+            self.references_request = None
+            self.main_window.stop_progress()
+
+    def show_references(self, references: Optional[list]):
+        if self.references_request is not None:
+            self.references_request = None
+            self.main_window.stop_progress()
+        if references is None:
+            QMessageBox.warning(self, "Error", "Could not find references")
+            return
+        self.main_window.show_references(references)
+
+    def show_definition(self, definitions: Optional[list]):
+        if self.goto_request is not None:
+            self.goto_request = None
+            self.main_window.stop_progress()
+        if definitions is None:
+            QMessageBox.warning(self, "Error", "Could not find definition")
+            return
+        if definitions:
+            definition = definitions[0] # added check
+            if definition["path"] and Path(definition["path"]).exists():
+                self.main_window.set_new_tab(Path(definition["path"]))
+                editor: Editor = self.main_window.tab_view.currentWidget()
+                editor.setCursorPosition(definition["line"] - 1, definition["column"])
@@ -0,0 +1,177 @@
+import heapq
+import re
+from typing import Any, Iterator, List, Optional, Set, Tuple
+
+# fuzzy matches are only scored for this many candidates matching in the file name,
+# and as many matching only elsewhere in the path (shortest file names first)
+MAX_SCORED = 500
+FUZZY_SEPARATORS = frozenset("/\\_-. ")
+
+
+def subsequence_pattern(query: str) -> re.Pattern:
+    """Regex matching strings that contain `query` as a subsequence"""
+    parts = []
+    for c in query:
+        c = re.escape(c)
+        # the class excludes the char that follows so the regex doesn't backtrack
+        parts.append(f"[^{c}]*{c}")
+    return re.compile("".join(parts), re.DOTALL)
+
+
+def char_bucket(c: str) -> int:
+    """Bitset bucket of a lower-cased char, letters and digits get their own"""
+    o = ord(c)
+    if 97 <= o <= 122:
+        return o - 97
+    if 48 <= o <= 57:
+        return o - 22
+    return 36 + o % 28
+
+
+def char_bitsets(texts: List[str]) -> List[int]:
+    """Bit i of bitsets[b] is set if texts[i] contains a char of bucket b"""
+    buckets = {}
+    columns = [bytearray(b"0") * len(texts) for _ in range(64)]
+    for i, t in enumerate(texts):
+        for c in set(t):
+            b = buckets.get(c)
+            if b is None:
+                b = buckets[c] = char_bucket(c)
+            columns[b][i] = 49  # "1"
+    return [int(col[::-1] or b"0", 2) for col in columns]
+
+
+def possible_matches(bitsets: List[int], query: str) -> Iterator[int]:
+    """Indices of the texts containing every char of `query`, in order"""
+    bits = -1
+    for c in set(query):
+        bits &= bitsets[char_bucket(c)]
+    # text i is a possible match if char i of the reversed binary string is "1"
+    flags = bin(bits)[:1:-1] if bits > 0 else ""
+    i = flags.find("1")
+    while i != -1:
+        yield i
+        i = flags.find("1", i + 1)
+
+
+def first_matches(indices: Iterator[int], texts: List[str], match, skip: Set[int]) -> Tuple[List[int], bool]:
+    """The first MAX_SCORED of `indices` not in `skip` whose text matches, and whether that's all of them"""
+    found = []
+    for i in indices:
+        if i not in skip and match(texts[i]):
+            found.append(i)
+            if len(found) >= MAX_SCORED:
+                return found, False
+    return found, True
+
+
+def file_name(text: str) -> str:
+    return text[max(text.rfind("/"), text.rfind("\\")) + 1:]
+
+
+def match_positions(query: str, lower: str, start: int = 0) -> Optional[List[int]]:
+    positions = []
+    pos = start
+    for c in query:
+        pos = lower.find(c, pos)
+        if pos == -1:
+            return None
+        positions.append(pos)
+        pos += 1
+    return positions
+
+
+def fuzzy_score(query: str, text: str, lower: str = None) -> Optional[int]:
+    """Score `text` against a lower-cased query, None if the query isn't a subsequence of it.
+
+    Consecutive chars, chars at word boundaries and matches inside the file
+    name rank higher, gaps between matched chars rank lower.
+    """
+    lower = lower or text.lower()
+    base = max(lower.rfind("/"), lower.rfind("\\")) + 1
+    positions = match_positions(query, lower, base) or match_positions(query, lower)
+    if positions is None:
+        return None
+
+    score = 12 if positions[0] >= base else 0
+    prev = -2
+    for p in positions:
+        if p == prev + 1:
+            score += 8
+        elif prev >= 0:
+            score -= min(p - prev - 1, 3)
+        if p == 0 or text[p - 1] in FUZZY_SEPARATORS or (text[p].isupper() and text[p - 1].islower()):
+            score += 10
+        prev = p
+    return score
+
+
+class FuzzyFinder:
+    """Ranks a fixed list of candidates against fuzzy queries.
+
+    For every letter and digit (other chars share the remaining buckets)
+    there is a bitset of the candidates containing it, and one of the
+    candidates whose file name contains it. AND-ing the bitsets of the query
+    chars rejects most candidates without looking at them. The rest are
+    checked with a subsequence regex, file names first since matching there
+    scores higher, then whole paths. Matches are scored and the best `k` are
+    picked with a heap.
+    """
+
+    def __init__(self, texts: List[str] = None, payloads: List[Any] = None):
+        texts = texts or []
+        payloads = payloads if payloads is not None else texts
+        # shortest file names first, so the cut-off at MAX_SCORED keeps the most specific
+        # names however deep their folder is
+        order = sorted(range(len(texts)), key=lambda i: (len(file_name(texts[i])), len(texts[i]), texts[i]))
+        self.texts = [texts[i] for i in order]
+        self.payloads = [payloads[i] for i in order]
+        self.lower = [t.lower() for t in self.texts]
+        self.names = [file_name(t) for t in self.lower]
+        self.bitsets = char_bitsets(self.lower)
+        self.name_bitsets = char_bitsets(self.names)
+
+        self.last_query = ""
+        self.last_matches: List[int] = []
+        self.last_complete = False
+
+    def __len__(self):
+        return len(self.texts)
+
+    def candidates(self, query: str) -> List[int]:
+        """Indices of the candidates matching `query`.
+
+        At most MAX_SCORED of them match in the file name, and as many only
+        elsewhere in the path, the ones with the shortest file names.
+        """
+        match = subsequence_pattern(query).match
+        if self.last_complete and self.last_query and query.startswith(self.last_query):
+            # the new query narrows the old one, only its matches can still match
+            in_name = [i for i in self.last_matches if match(self.names[i])]
+            found = set(in_name)
+            in_path = [i for i in self.last_matches if i not in found and match(self.lower[i])]
+            complete = True
+        else:
+            in_name, names_complete = first_matches(
+                possible_matches(self.name_bitsets, query), self.names, match, set())
+            in_path, paths_complete = first_matches(
+                possible_matches(self.bitsets, query), self.lower, match, set(in_name))
+            complete = names_complete and paths_complete
+
+        self.last_query = query
+        self.last_matches = matches = in_name + in_path
+        self.last_complete = complete
+        return matches
+
+    def match(self, query: str, k: int = 50) -> List[Any]:
+        """Payloads of the `k` best matches, best first"""
+        query = query.strip().lower()
+        if not query:
+            return self.payloads[:k]
+
+        scored = []
+        for i in self.candidates(query):
+            score = fuzzy_score(query, self.texts[i], self.lower[i])
+            if score is not None:
+                scored.append((score, -i))
+        return [self.payloads[-i] for _, i in heapq.nlargest(k, scored)]
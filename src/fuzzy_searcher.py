@@ -1,13 +1,35 @@
-from PyQt5.QtCore import QThread, pyqtSignal
-from PyQt5.QtWidgets import QListWidgetItem
+from PyQt5.QtCore import QAbstractListModel, QModelIndex, QThread, QTimer, Qt, pyqtSignal
+from PyQt5.QtGui import QKeyEvent
+from PyQt5.QtWidgets import QDialog, QLineEdit, QListWidget, QListWidgetItem, QVBoxLayout
+from array import array
 import os
-from pathlib import Path
 import re
-from typing import List, Tuple
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from analysis import AnalysisClient
+from fuzzy import FuzzyFinder
+from scanner import ParallelScanner
+from trigram_index import TrigramIndex
+from walker import EXCLUDE_DIRS, EXCLUDE_SUFFIXES, Walker
+
+# seconds between two background refreshes of the project indexes
+INDEX_REFRESH_INTERVAL = 15
+# partial results are flushed when a batch gets this big or this old (seconds)
+BATCH_SIZE = 200
+BATCH_INTERVAL = 0.05
+# a search stops once it found this many hits
+MAX_RESULTS = 500_000
+# how long (seconds) the files of a finished search can be reused for a narrower query
+NARROW_MAX_AGE = 10
+SYMBOL_RE = re.compile(r"^[ \t]*(?:async[ \t]+)?(?:def|class)[ \t]+(\w+)", re.MULTILINE)
+SYMBOL_SUFFIXES = {".py", ".pyw"}
+
+class SearchItem:
+    __slots__ = ("name", "full_path", "lineno", "end", "line")
 
-class SearchItem(QListWidgetItem):
     def __init__(self, name: str, full_path: str, lineno: int, end: int, line: str):
-        super().__init__(f'{name}:{lineno}:{end} - {line} ...')
         self.name = name
         self.full_path = full_path
         self.lineno = lineno
@@ -20,71 +42,497 @@ class SearchItem(QListWidgetItem):
     def __repr__(self):
         return str(self)
 
+
+class SearchResults:
+    """Compact store of search hits.
+
+    Paths are stored once, numbers in arrays and previews in a single utf8
+    buffer, so a hit costs a few dozen bytes instead of a Python object.
+    """
+    __slots__ = ("paths", "path_ids", "file_ids", "linenos", "ends", "offsets", "text")
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.paths: List[str] = []
+        self.path_ids: Dict[str, int] = {}
+        self.file_ids = array("I")
+        self.linenos = array("I")
+        self.ends = array("I")
+        self.offsets = array("Q", [0])
+        self.text = bytearray()
+
+    def __len__(self):
+        return len(self.file_ids)
+
+    def extend(self, hits: List[Tuple[str, int, int, str]]):
+        for full_path, lineno, end, line in hits:
+            file_id = self.path_ids.get(full_path)
+            if file_id is None:
+                file_id = self.path_ids[full_path] = len(self.paths)
+                self.paths.append(full_path)
+            self.file_ids.append(file_id)
+            self.linenos.append(lineno)
+            self.ends.append(end)
+            self.text += line.encode("utf8")
+            self.offsets.append(len(self.text))
+
+    def line(self, row: int) -> str:
+        return self.text[self.offsets[row]:self.offsets[row + 1]].decode("utf8")
+
+    def item(self, row: int) -> SearchItem:
+        full_path = self.paths[self.file_ids[row]]
+        return SearchItem(os.path.basename(full_path), full_path, self.linenos[row], self.ends[row], self.line(row))
+
+
+class SearchResultModel(QAbstractListModel):
+    """List model over SearchResults, labels are only built for the rows on screen"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.results = SearchResults()
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.results)
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.DisplayRole:
+            return str(self.results.item(index.row()))
+        if role == Qt.ToolTipRole:
+            return self.results.paths[self.results.file_ids[index.row()]]
+        return None
+
+    def append(self, hits: List[Tuple[str, int, int, str]]):
+        if not hits:
+            return
+        first = len(self.results)
+        self.beginInsertRows(QModelIndex(), first, first + len(hits) - 1)
+        self.results.extend(hits)
+        self.endInsertRows()
+
+    def clear(self):
+        self.beginResetModel()
+        self.results.clear()
+        self.endResetModel()
+
+    def item(self, index: QModelIndex) -> SearchItem:
+        return self.results.item(index.row())
+
+
+class CancelToken:
+    """Shared flag telling a running search to stop as soon as possible"""
+
+    def __init__(self):
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
 class SearchWorker(QThread):
-    finished = pyqtSignal(list)
+    # (search id, batch of (full_path, lineno, end, line) hits), emitted while the search is running
+    results = pyqtSignal(int, list)
+    # number of hits
+    finished = pyqtSignal(int)
 
     def __init__(self):
         super().__init__()
-        self.items: List[SearchItem] = []
+        self.count = 0
+        self.batch: List[Tuple[str, int, int, str]] = []
+        self.hit_files: List[str] = []
+        # (pattern, path, search_project, files with hits, finish time, index generation) of the last complete search
+        self.last_search: Tuple[str, str, bool, List[str], float, int] = None
+        self.generation = 0
+        self.last_flush = 0.0
+        self.search_id = 0
+        self.token = CancelToken()
+        self.pending: Tuple[int, str, str, bool] = None
+        self.active = False
+        self.lock = threading.Lock()
         self.search_path: str = None
         self.search_text: str = None
         self.search_project: bool = None
+        self.indexes: Dict[str, TrigramIndex] = {}
+        self.changed_files: Set[str] = set()
+        # files changed outside the editor (checkouts, formatters) only show up in a
+        # stat of the tree, it runs on a timer so searches never walk the tree
+        self.refresher: threading.Thread = None
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setInterval(INDEX_REFRESH_INTERVAL * 1000)
+        self.refresh_timer.timeout.connect(self.refresh_indexes)
+        self.refresh_timer.start()
+        self.scanner = ParallelScanner()
+        # starting the fork server takes a while, not on the first search
+        threading.Thread(target=self.scanner.warm_up, daemon=True).start()
 
-    def is_binary(self, path: str) -> bool:
-        try:
-            with open(path, 'rb') as f:
-                return b'\0' in f.read(1024)
-        except IOError:
-            return True
-
-    def walkdir(self, path: str, exclude_dirs: List[str], exclude_files: List[str]):
-        for root, dirs, files, in os.walk(path, topdown=True):
-            dirs[:] = [d for d in dirs if d not in exclude_dirs]
-            files[:] = [f for f in files if Path(f).suffix not in exclude_files]
-            yield root, dirs, files
-
-    def search(self):
-        self.items = []
-        exclude_dirs = {".git", ".svn", ".hg", ".bzr", ".idea", "__pycache__", "venv"}
+    def get_walker(self) -> Walker:
+        # searching in modules also looks into venvs and ignored files
         if self.search_project:
-            exclude_dirs.remove("venv")
-        exclude_files = {".svg", ".png", ".exe", ".pyc", ".qm"}
+            return Walker.for_root(self.search_path, EXCLUDE_DIRS - {"venv"}, EXCLUDE_SUFFIXES, use_ignore_files=False)
+        return Walker.for_root(self.search_path)
 
-        for root, _, files in self.walkdir(self.search_path, exclude_dirs, exclude_files):
-            if len(self.items) > 5_000:
-                break
+    def get_index(self, walker: Walker) -> TrigramIndex:
+        index = TrigramIndex(walker)
+        if index.path in self.indexes:
+            index = self.indexes[index.path]
+        else:
+            index.load()
+            # the first search in a folder builds the index or catches up with the saved one
+            index.refresh()
+            self.indexes[index.path] = index
 
-            for file_ in files:
-                full_path = os.path.join(root, file_)
-                if self.is_binary(full_path):
-                    continue
+        for path in list(self.changed_files):
+            if path.startswith(index.root + os.sep):
+                self.changed_files.discard(path)
+                index.update_file(path)
+        return index
+
+    def refresh_indexes(self):
+        """Refresh the indexes of the folders searched so far on a background thread"""
+        if self.refresher is not None and self.refresher.is_alive():
+            return
+        self.refresher = threading.Thread(target=self._refresh_indexes, args=(list(self.indexes.values()),), daemon=True)
+        self.refresher.start()
+
+    def _refresh_indexes(self, indexes: List[TrigramIndex]):
+        for index in indexes:
+            try:
+                index.refresh()
+            except Exception as e:
+                print(f"SearchWorker error: {e}")
+
+    def file_changed(self, path: str):
+        """Queue a file to be reindexed before the next search (e.g. after it was saved)"""
+        self.changed_files.add(os.path.abspath(path))
 
+    def narrows_last_search(self, generation: int) -> bool:
+        """True if every hit of the current query must be in a file the last search found.
+
+        That holds when both are literals and the new one strictly extends the
+        old one (e.g. a char was typed), the last search ran to completion,
+        and the index didn't change since. Repeating a query scans again.
+        """
+        if self.last_search is None:
+            return False
+        pattern, path, search_project, _, finished, last_generation = self.last_search
+        return (
+            path == self.search_path
+            and search_project == self.search_project
+            and last_generation == generation
+            and time.monotonic() - finished < NARROW_MAX_AGE
+            and re.escape(pattern) == pattern
+            and re.escape(self.search_text) == self.search_text
+            and len(self.search_text) > len(pattern)
+            and pattern.lower() in self.search_text.lower()
+        )
+
+    def candidate_files(self, walker: Walker):
+        """(path, size) of the files to scan, files known to be binary are skipped"""
+        index = self.get_index(walker)
+        self.generation = index.generation
+        if self.narrows_last_search(index.generation):
+            for path in self.last_search[3]:
                 try:
-                    with open(full_path, 'r', encoding='utf8') as f:
-                        reg = re.compile(self.search_text, re.IGNORECASE)
-                        for i, line in enumerate(f):
-                            if m := reg.search(line):
-                                self.items.append(SearchItem(
-                                    file_,
-                                    full_path,
-                                    i,
-                                    m.end(),
-                                    line[m.start():].strip()[:50]
-                                ))
-                except (re.error, UnicodeDecodeError) as e:
-                    print(f"SearchWorker error: {e}")
-                    continue
-                except Exception as e:
-                    print(f"SearchWorker error: {e}")
+                    yield path, os.path.getsize(path)
+                except OSError:
                     continue
+            return
+
+        candidates = index.candidates(self.search_text)
+        if candidates is None:
+            candidates = ((path, size) for path, _, size in walker.walk())
+
+        for path, size in candidates:
+            if not walker.known_binary(path):
+                yield path, size
+
+    def flush(self, search_id: int, token: CancelToken):
+        self.count += len(self.batch)
+        if self.batch and not token.cancelled:
+            self.results.emit(search_id, self.batch)
+        self.batch = []
+        self.last_flush = time.monotonic()
+
+    def search(self, search_id: int, token: CancelToken):
+        self.count = 0
+        self.batch = []
+        self.hit_files = []
+        self.last_flush = time.monotonic()
+        walker = self.get_walker()
+
+        try:
+            re.compile(self.search_text, re.IGNORECASE)
+        except re.error as e:
+            print(f"SearchWorker error: {e}")
+            self.finished.emit(self.count)
+            return
+
+        first = True
+        capped = False
+        results = self.scanner.scan(self.candidate_files(walker), self.search_text, re.IGNORECASE)
+        for full_path, hits in results:
+            if token.cancelled:
+                results.close()
+                return
+            if self.count + len(self.batch) >= MAX_RESULTS:
+                results.close()
+                capped = True
+                break
+            if hits is None:
+                walker.mark_binary(full_path)
+                continue
+            if not hits:
+                continue
 
-        self.finished.emit(self.items)
+            self.hit_files.append(full_path)
+            self.batch.extend((full_path, *hit) for hit in hits)
+
+            # the first hits go out right away, the rest in batches
+            if first or len(self.batch) >= BATCH_SIZE or time.monotonic() - self.last_flush > BATCH_INTERVAL:
+                self.flush(search_id, token)
+                first = False
+
+        self.flush(search_id, token)
+        if token.cancelled:
+            return
+        if not capped:
+            self.last_search = (self.search_text, self.search_path, self.search_project, self.hit_files,
+                                time.monotonic(), self.generation)
+        self.finished.emit(self.count)
+
+    def run(self):
+        while True:
+            with self.lock:
+                if self.pending is None:
+                    self.active = False
+                    return
+                search_id, self.search_text, self.search_path, self.search_project = self.pending
+                self.pending = None
+                token = self.token
+            self.search(search_id, token)
+
+    def update(self, pattern: str, path: str, search_project: bool) -> int:
+        """Start a search, cancelling the one in progress. Returns the new search id"""
+        with self.lock:
+            self.token.cancel()
+            self.token = CancelToken()
+            self.search_id += 1
+            self.pending = (self.search_id, pattern, path, search_project)
+            if not self.active:
+                self.active = True
+                # the previous run() may still be unwinding
+                self.wait()
+                self.start()
+            return self.search_id
+
+    def cancel(self):
+        with self.lock:
+            self.token.cancel()
+            self.pending = None
+
+
+class FuzzyIndex:
+    """Files and python symbols of a folder, kept up to date by mtime"""
+
+    def __init__(self, walker: Walker):
+        self.walker = walker
+        self.root = walker.root
+        # path -> (mtime, [(symbol, lineno)])
+        self.files: Dict[str, Tuple[float, List[Tuple[str, int]]]] = {}
+        self.file_finder = FuzzyFinder()
+        self.symbol_finder = FuzzyFinder()
+
+    def read_symbols(self, path: str) -> List[Tuple[str, int]]:
+        if os.path.splitext(path)[1] not in SYMBOL_SUFFIXES:
+            return []
+        try:
+            with open(path, "r", encoding="utf8") as f:
+                text = f.read()
+        except (OSError, UnicodeDecodeError):
+            return []
+
+        symbols = []
+        lineno = 0
+        last = 0
+        for m in SYMBOL_RE.finditer(text):
+            lineno += text.count("\n", last, m.start())
+            last = m.start()
+            symbols.append((m.group(1), lineno))
+        return symbols
+
+    def refresh(self) -> bool:
+        """Rescan the folder, returns True if anything changed"""
+        changed = False
+        seen = set()
+        for path, mtime, _ in self.walker.walk():
+            seen.add(path)
+            entry = self.files.get(path)
+            if entry is None or entry[0] != mtime:
+                self.files[path] = (mtime, self.read_symbols(path))
+                changed = True
+
+        for path in [p for p in self.files if p not in seen]:
+            del self.files[path]
+            changed = True
+
+        if changed or not len(self.file_finder):
+            self.rebuild()
+        return changed
+
+    def rebuild(self):
+        paths = list(self.files)
+        self.file_finder = FuzzyFinder([os.path.relpath(p, self.root) for p in paths], paths)
+
+        names = []
+        locations = []
+        for path, (_, symbols) in self.files.items():
+            for name, lineno in symbols:
+                names.append(name)
+                locations.append((name, path, lineno))
+        self.symbol_finder = FuzzyFinder(names, locations)
+
+
+class FuzzyIndexWorker(QThread):
+    ready = pyqtSignal()
+
+    def __init__(self):
+        super().__init__()
+        self.index: FuzzyIndex = None
+
+    def set_root(self, root: str):
+        root = os.path.abspath(root)
+        if self.index is None or self.index.root != root:
+            self.index = FuzzyIndex(Walker.for_root(root))
 
     def run(self):
-        self.search()
+        if self.index.refresh():
+            self.ready.emit()
+
+    def refresh(self):
+        if not self.isRunning():
+            self.start()
+
+
+class PickerDialog(QDialog):
+    """Popup with a query line over a list, items carry (path, lineno) in UserRole"""
+    # path, lineno (-1 for files)
+    picked = pyqtSignal(str, int)
+
+    def __init__(self, placeholder: str, parent=None):
+        super().__init__(parent, Qt.Popup)
+        self.resize(600, 400)
+
+        layout = QVBoxLayout()
+        layout.setContentsMargins(5, 5, 5, 5)
+        self.input = QLineEdit()
+        self.input.setPlaceholderText(placeholder)
+        self.input.textChanged.connect(self.update_results)
+        self.input.returnPressed.connect(self.accept_current)
+        self.input.keyPressEvent = self.input_key_press
+        self.list = QListWidget()
+        self.list.itemActivated.connect(self.accept_current)
+        self.list.itemClicked.connect(self.accept_current)
+        layout.addWidget(self.input)
+        layout.addWidget(self.list)
+        self.setLayout(layout)
+
+    def popup(self):
+        self.input.clear()
+        self.update_results()
+        parent = self.parentWidget()
+        if parent is not None:
+            self.move(parent.mapToGlobal(parent.rect().center()).x() - self.width() // 2,
+                      parent.mapToGlobal(parent.rect().topLeft()).y() + 60)
+        self.show()
+        self.input.setFocus()
+
+    def input_key_press(self, e: QKeyEvent):
+        if e.key() in (Qt.Key_Down, Qt.Key_Up):
+            row = self.list.currentRow() + (1 if e.key() == Qt.Key_Down else -1)
+            self.list.setCurrentRow(max(0, min(row, self.list.count() - 1)))
+            return
+        QLineEdit.keyPressEvent(self.input, e)
+
+    def update_results(self):
+        """Fill the list for the current query, subclasses search something"""
+        self.show_items([])
+
+    def show_items(self, items: List[Tuple[str, str, int]]):
+        """Show (label, path, lineno) rows with the first one selected"""
+        self.list.clear()
+        for label, path, lineno in items:
+            item = QListWidgetItem(label)
+            item.setData(Qt.UserRole, (path, lineno))
+            self.list.addItem(item)
+        self.list.setCurrentRow(0)
+
+    def accept_current(self, *_):
+        item = self.list.currentItem()
+        if item is None:
+            return
+        path, lineno = item.data(Qt.UserRole)
+        self.hide()
+        self.picked.emit(path, lineno)
+
+
+class FuzzyFinderDialog(PickerDialog):
+    """Ctrl+P style picker, a query starting with # searches symbols instead of files"""
+
+    def __init__(self, worker: FuzzyIndexWorker, parent=None):
+        super().__init__("Search files by name (# for symbols)", parent)
+        self.worker = worker
+        self.worker.ready.connect(self.update_results)
+
+    def popup(self):
+        self.worker.refresh()
+        super().popup()
+
+    def update_results(self):
+        index = self.worker.index
+        if index is None:
+            self.show_items([])
+            return
+
+        text = self.input.text()
+        if text.startswith("#"):
+            self.show_items([
+                (f"{name}  {os.path.relpath(path, index.root)}:{lineno + 1}", path, lineno)
+                for name, path, lineno in index.symbol_finder.match(text[1:])
+            ])
+        else:
+            self.show_items([(os.path.relpath(path, index.root), path, -1) for path in index.file_finder.match(text)])
+
+
+class WorkspaceSymbolsDialog(PickerDialog):
+    """Picker over the definitions of the analysis server's symbol index, methods included"""
+
+    def __init__(self, client: AnalysisClient, parent=None):
+        super().__init__("Search symbols in the workspace", parent)
+        self.client = client
+        self.root = ""
+        self.request_id: Optional[int] = None
+
+    def set_root(self, root: str):
+        self.root = root
+
+    def update_results(self):
+        # every keystroke supersedes the query in flight
+        if self.request_id is not None:
+            self.client.cancel(self.request_id)
+        self.request_id = self.client.request(
+            "symbols", {"query": self.input.text(), "limit": 50}, self.load_results)
 
-    def update(self, pattern: str, path: str, search_project: bool):
-        self.search_text = pattern
-        self.search_path = path
-        self.search_project = search_project
-        self.start()
+    def load_results(self, symbols: Optional[list]):
+        self.request_id = None
+        if symbols is None:
+            return
+        items = []
+        for symbol in symbols:
+            path = symbol["path"]
+            if self.root and path.startswith(self.root):
+                path = os.path.relpath(path, self.root)
+            items.append((f"{symbol['name']}  {symbol['kind']}  {path}:{symbol['line']}", symbol["path"], symbol["line"] - 1))
+        self.show_items(items)
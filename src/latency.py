@@ -0,0 +1,59 @@
+import math
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Sequence
+
+# samples kept per stage, older ones are dropped
+LATENCY_WINDOW = 200
+# stages of a completion request, in the order they happen
+COMPLETION_STAGES = ("queue", "script", "complete", "prepare", "total")
+
+
+def percentile(values: Sequence[float], p: float) -> float:
+    """Nearest rank percentile of unsorted values, p in 0..100"""
+    ordered = sorted(values)
+    rank = max(math.ceil(p / 100 * len(ordered)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+class LatencyStats:
+    """Recent durations (ms) per stage of the completion pipeline, shared by every editor"""
+
+    _instance: "LatencyStats" = None
+
+    @classmethod
+    def get(cls) -> "LatencyStats":
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self, window: Optional[int] = LATENCY_WINDOW):
+        self.window = window
+        self.samples: Dict[str, Deque[float]] = {}
+
+    def add(self, stage: str, ms: float):
+        samples = self.samples.get(stage)
+        if samples is None:
+            samples = self.samples[stage] = deque(maxlen=self.window)
+        samples.append(ms)
+
+    def add_sample(self, timings: Dict[str, float]):
+        for stage, ms in timings.items():
+            self.add(stage, ms)
+
+    def count(self, stage: str) -> int:
+        return len(self.samples.get(stage, ()))
+
+    def percentiles(self, stage: str, ps: Iterable[float] = (50, 95)) -> Optional[List[float]]:
+        samples = self.samples.get(stage)
+        if not samples:
+            return None
+        return [percentile(samples, p) for p in ps]
+
+    def describe(self, stages: Iterable[str] = COMPLETION_STAGES) -> List[str]:
+        """One "stage p50 / p95 ms (n)" line per stage with samples"""
+        lines = []
+        for stage in stages:
+            found = self.percentiles(stage)
+            if found is not None:
+                lines.append(f"{stage}: {found[0]:.0f} / {found[1]:.0f} ms ({self.count(stage)})")
+        return lines
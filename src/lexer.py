@@ -1,20 +1,45 @@
-import re
-import keyword
-import builtins
-import types
-import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Optional
 
 from PyQt5.Qsci import QsciLexerCustom, QsciScintilla
 from PyQt5.QtGui import QFont, QColor
 from PyQt5.QtCore import *
 from PyQt5.QtWidgets import *
 
+from theme import DEFAULT_THEME_PATH, Theme
+from syntax import PYTHON, STATE_DEFAULT, Language, StyledText, language_for_suffix, style_document
+
 
 # config type
 DefaultConfig = dict[str, str, tuple[str, int]]
 
+# styling requests spanning more lines than this are tokenized off the GUI thread
+BACKGROUND_LINES = 2000
+# lines styled around the visible ones while the background result isn't there
+VIEWPORT_MARGIN = 50
+# lines of a background result applied per event loop iteration
+APPLY_CHUNK_LINES = 5000
+# documents bigger than this aren't styled in the background, they are styled
+# from the top on the GUI thread a few lines at a time while it is idle
+LAZY_HIGHLIGHT_SIZE = 8 * 1024 * 1024
+# seconds of idle styling per event loop iteration, and lines styled in the first one
+IDLE_SLICE = 0.008
+IDLE_FIRST_LINES = 100
+# files bigger than this aren't highlighted at all
+MAX_HIGHLIGHT_SIZE = 64 * 1024 * 1024
+
 class NeutronLexer(QsciLexerCustom):
-    """Base Custo Lexer class for all language"""
+    """Base Custo Lexer class for all language
+
+    Text is styled line by line, the state at the end of every line is kept in
+    Scintilla's line state so styling can restart at any line. Subclasses
+    implement style_line.
+    """
+
+    STATE_DEFAULT = STATE_DEFAULT
 
     def __init__(self, language_name, editor, theme=None, defaults: DefaultConfig = None):
         super(NeutronLexer, self).__init__(editor)
@@ -23,14 +48,15 @@ class NeutronLexer(QsciLexerCustom):
         self.language_name = language_name
         self.theme_json = None
         if theme is None:
-            self.theme = "./theme.json"
+            self.theme = DEFAULT_THEME_PATH
         else:
             self.theme = theme
 
-        self.token_list: list[str, str] = []
-
-        self.keywords_list = []
-        self.builtin_names = []
+        # last line changed since it was styled, -1 when every styled line is up to date
+        self.dirty_end = -1
+        # bumped on every text change
+        self.version = 0
+        editor.SCN_MODIFIED.connect(self._text_modified)
 
         if defaults is None:
             defaults: DefaultConfig = {}
@@ -47,14 +73,6 @@ class NeutronLexer(QsciLexerCustom):
         self._init_theme_vars()
         self._init_theme()
 
-    def setKeywords(self, keywords: list[str]):
-        """Set List of strings that considered keywords for this language."""
-        self.keywords_list =keywords
-
-    def setBuiltinNames(self, buitin_names: list[str]):
-        """Set list of builtin names"""
-        self.builtin_names = buitin_names
-
     def _init_theme_vars(self):
         # color per style
 
@@ -70,64 +88,23 @@ class NeutronLexer(QsciLexerCustom):
         self.CLASSES = 9
         self.FUNCTION_DEF = 10
 
-        self.default_names = [
-            "default",
-            "keyword",
-            "types",
-            "string",
-            "keyargs",
-            "brackets",
-            "comments",
-            "constants",
-            "functions",
-            "classes",
-            "function_def"
-        ]
-
-        self.font_weights = {
-            "thin": QFont.Thin,
-            "extralight": QFont.ExtraLight,
-            "light": QFont.Light,
-            "normal": QFont.Normal,
-            "medium": QFont.Medium,
-            "demibold": QFont.DemiBold,
-            "bold": QFont.Bold,
-            "extrabold": QFont.ExtraBold,
-            "black": QFont.Black,
-        }
-
     def _init_theme(self):
-        with open("theme.json", "r") as f:
-            self.theme_json = json.load(f)
-
-        colors = self.theme_json["theme"]["syntax"]
-
-        for clr in colors:
-            name: str = list(clr.keys())[0]
-
-            if name not in self.default_names:
-                print(f"Theme error: {name} is not a valid style name")
-                continue
-            
-            for k, v in clr[name].items():
-                if k == "color":
-                    self.setColor(QColor(v), getattr(self, name.upper()))
-                elif k == "paper-color":
-                    self.setPaper(QColor(v), getattr(self, name.upper()))
-                elif k == "font":
-                    try:
-                        self.setFont(
-                            QFont(
-                                v.get("family", "Consolas"), 
-                                v.get("font-size", 14),
-                                self.font_weights.get(v.get("font-weight", QFont.Normal)),
-                                v.get("italic", False)
-                            ),
-                            getattr(self, name.upper())
-                        )    
-                    except AttributeError as e:
-                        print(f"theme error: {e}")
-            
+        # parsed once per file and shared by all lexers, reloaded when the file changes
+        self.theme_registry = Theme.get(self.theme)
+        self.theme_json = self.theme_registry.data
+        self.theme_registry.changed.connect(self.apply_theme)
+        self.apply_theme()
+
+    def apply_theme(self):
+        self.theme_json = self.theme_registry.data
+        for name, style in self.theme_registry.styles.items():
+            style_id = getattr(self, name.upper())
+            if style.color is not None:
+                self.setColor(style.color, style_id)
+            if style.paper is not None:
+                self.setPaper(style.paper, style_id)
+            if style.font is not None:
+                self.setFont(style.font, style_id)
 
     def language(self) -> str:
         return self.language_name
@@ -158,140 +135,279 @@ class NeutronLexer(QsciLexerCustom):
 
         return ""
 
-    def generate_token(self, text):
-        # 3. Tokenize the text 
-        # ---------------------
-        p = re.compile(r"[*]\/|\/[*]|\s+|\w+|\W")
-
-        # 'token_list' is a list of tuples: (token_name, token_len), ex: '(class, 5)' 
-        self.token_list =  [ (token, len(bytearray(token, "utf-8"))) for token in p.findall(text)]
-
-    def next_tok(self, skip: int = None):
-        if len(self.token_list) > 0:
-            if skip is not None and skip != 0:
-                for _ in range(skip-1):
-                    if len(self.token_list) > 0:
-                        self.token_list.pop(0)
-            return self.token_list.pop(0)
+    def _text_modified(self, position, modification_type, text, length, lines_added, *args):
+        if not modification_type & (QsciScintilla.SC_MOD_INSERTTEXT | QsciScintilla.SC_MOD_DELETETEXT):
+            return
+        self.version += 1
+        line = self.editor.SendScintilla(QsciScintilla.SCI_LINEFROMPOSITION, position)
+        if self.dirty_end >= line:
+            self.dirty_end += lines_added
+        self.dirty_end = max(self.dirty_end, line + max(lines_added, 0))
+
+    def styleText(self, start: int, end: int) -> None:
+        first = self.editor.SendScintilla(QsciScintilla.SCI_LINEFROMPOSITION, start)
+        last = self.editor.SendScintilla(QsciScintilla.SCI_LINEFROMPOSITION, end)
+        # a restyle from the top (new lexer, recolor) can't trust the old styles
+        self.style_lines(first, last, converge=first > 0)
+
+    def style_lines(self, line: int, last_line: int, converge: bool = True) -> None:
+        """Style lines [line, last_line] starting in the state stored for the line before.
+
+        With `converge`, styling stops at the first line past the edited ones
+        that ends in the same state as before.
+        """
+        editor = self.editor
+        start = editor.SendScintilla(QsciScintilla.SCI_POSITIONFROMLINE, line)
+        if last_line + 1 < editor.SendScintilla(QsciScintilla.SCI_GETLINECOUNT):
+            end = editor.SendScintilla(QsciScintilla.SCI_POSITIONFROMLINE, last_line + 1)
         else:
-            return None
-
-    def peek_tok(self, n=0):
-        try:
-            return self.token_list[n]
-        except IndexError:
-            return ['']
-
-    def skip_spaces_peek(self, skip=None):
-        """find he next non-space token but using peek without consuming it"""
-        i = 0
-        tok = " "
-        if skip is not None:
-            i = skip
-        while tok[0].isspace():
-            tok = self.peek_tok(i)
-            i += 1
-        return tok, i
-
-    
-class PyCustomLexer(NeutronLexer):
-    """Custom lexer for python"""
+            end = editor.SendScintilla(QsciScintilla.SCI_GETLENGTH)
+            if editor.SendScintilla(QsciScintilla.SCI_POSITIONFROMLINE, last_line) == end:
+                # an empty last line never gets styled, don't wait for it
+                self.dirty_end = min(self.dirty_end, last_line - 1)
+        if end <= start:
+            return
 
-    def __init__(self, editor):
-        super(PyCustomLexer, self).__init__("Python", editor)
+        state = editor.SendScintilla(QsciScintilla.SCI_GETLINESTATE, line - 1) if line > 0 else self.STATE_DEFAULT
 
-        self.setKeywords(keyword.kwlist)
-        self.setBuiltinNames([
-            name
-            for name, obj in vars(builtins).items()
-            if isinstance(obj, types.BuiltinFunctionType)
-        ])
+        # only the requested lines are copied out of Scintilla, bytes() adds a trailing NUL
+        data = editor.bytes(start, end).data()[:end - start]
 
-    def styleText(self, start: int, end: int) -> None:
-        # 1. Start styling procedure
         self.startStyling(start)
+        for raw in data.splitlines(keepends=True):
+            old_state = editor.SendScintilla(QsciScintilla.SCI_GETLINESTATE, line)
+            state = self.style_line(raw.decode("utf-8", errors="replace"), state)
+            editor.SendScintilla(QsciScintilla.SCI_SETLINESTATE, line, state)
+            line += 1
+            if line > self.dirty_end:
+                self.dirty_end = -1
+                if state == old_state and converge:
+                    # the following lines didn't change and start in the same
+                    # state as before, so their styles are still right
+                    self.startStyling(end)
+                    break
+
+    def style_line(self, text: str, state: int) -> int:
+        """Style one line (with its line ending) starting in `state`, returns the state at its end"""
+        self.setStyling(len(text.encode("utf-8")), self.DEFAULT)
+        return state
+
+
+class StyleWorker(QThread):
+    """Styles a snapshot of a whole document off the GUI thread"""
+    # document version, StyledText
+    ready = pyqtSignal(int, object)
+
+    def __init__(self, language: Language):
+        super().__init__()
+        self.language = language
+        self.pending: tuple[int, bytes] = None
+        self.active = False
+        self.lock = threading.Lock()
+
+    def run(self):
+        while True:
+            with self.lock:
+                if self.pending is None:
+                    self.active = False
+                    return
+                version, data = self.pending
+                self.pending = None
+            # a newer snapshot makes this one useless
+            styled = style_document(self.language, data, cancelled=lambda: self.pending is not None)
+            if styled is not None:
+                self.ready.emit(version, styled)
+
+    def style(self, version: int, data: bytes):
+        with self.lock:
+            self.pending = (version, data)
+            if not self.active:
+                self.active = True
+                # the previous run() may still be unwinding
+                self.wait()
+                self.start()
+
+
+class TableLexer(NeutronLexer):
+    """Lexer driven by the rule tables of a syntax.Language
+
+    Big styling requests (opening or pasting a large file, jumping to its end)
+    only style the visible lines right away. The whole document is styled by a
+    StyleWorker and its runs are applied in chunks from the event loop.
+
+    Documents too big to copy for the worker are styled from the top while
+    the event loop is idle. Lines shown before that reaches them are styled
+    from a guessed state, and styled again once when it does.
+    """
+
+    def __init__(self, editor, language: Language):
+        self.syntax = language
+        super(TableLexer, self).__init__(language.name, editor)
+
+        # background result for the document at `styled_version`
+        self.styled: Optional[StyledText] = None
+        self.styled_version = -1
+        # lines of the document were skipped and wait for a background result
+        self.background_pending = False
+        self.apply_line = 0
+        self.apply_timer = QTimer(self)
+        self.apply_timer.setInterval(0)
+        self.apply_timer.timeout.connect(self.apply_chunk)
+        self.worker = StyleWorker(language)
+        self.worker.ready.connect(self.background_ready)
+        # lines above it are styled from the real state, -1 when the idle styling is done
+        self.idle_line = -1
+        # the idle styling starts with the first styling request of a big document
+        self.idle_started = False
+        self.idle_lines = IDLE_FIRST_LINES
+        self.idle_timer = QTimer(self)
+        self.idle_timer.setInterval(0)
+        self.idle_timer.timeout.connect(self.idle_chunk)
+
+    def _text_modified(self, position, modification_type, text, length, lines_added, *args):
+        version = self.version
+        super()._text_modified(position, modification_type, text, length, lines_added, *args)
+        if self.idle_line > 0 and lines_added:
+            line = self.editor.SendScintilla(QsciScintilla.SCI_LINEFROMPOSITION, position)
+            if self.idle_line > line:
+                self.idle_line = max(line, self.idle_line + lines_added)
+        if version != self.version and self.styled is not None:
+            # positions in the result are no good anymore
+            self.styled = None
+            self.apply_timer.stop()
+            if self.background_pending:
+                self.start_background()
+
+    def styleText(self, start: int, end: int) -> None:
+        editor = self.editor
+        first = editor.SendScintilla(QsciScintilla.SCI_LINEFROMPOSITION, start)
+        last = editor.SendScintilla(QsciScintilla.SCI_LINEFROMPOSITION, end)
+
+        if self.styled is not None and self.styled_version == self.version:
+            self.apply_lines(first, last + 1)
+            return
+        lazy = editor.SendScintilla(QsciScintilla.SCI_GETLENGTH) > LAZY_HIGHLIGHT_SIZE
+        if lazy and not self.idle_started:
+            self.idle_started = True
+            self.idle_line = first
+            self.idle_timer.start()
+        if last - first < BACKGROUND_LINES:
+            super().styleText(start, end)
+            if first <= self.idle_line <= last:
+                # styled on from the real state, the idle styling doesn't need to redo it
+                self.idle_line = last + 1
+            return
+
+        # only what is on screen is styled now, the rest is left to the background
+        # worker or, for huge documents, to idle time
+        if lazy:
+            self.idle_line = first if self.idle_line < 0 else min(self.idle_line, first)
+            self.idle_timer.start()
+        else:
+            self.background_pending = True
+            self.start_background()
+
+        top = editor.SendScintilla(QsciScintilla.SCI_DOCLINEFROMVISIBLE,
+                                   editor.SendScintilla(QsciScintilla.SCI_GETFIRSTVISIBLELINE))
+        top = max(first, top - VIEWPORT_MARGIN)
+        bottom = min(last, top + editor.SendScintilla(QsciScintilla.SCI_LINESONSCREEN) + 2 * VIEWPORT_MARGIN)
+        if top <= bottom:
+            # the state before `top` is a guess until the lines above are styled
+            self.style_lines(top, bottom, converge=False)
+            if top <= self.idle_line <= bottom:
+                self.idle_line = bottom + 1
+
+    def idle_chunk(self):
+        editor = self.editor
+        line_count = editor.SendScintilla(QsciScintilla.SCI_GETLINECOUNT)
+        if self.idle_line < 0 or self.idle_line >= line_count:
+            self.idle_line = -1
+            self.idle_timer.stop()
+            return
+        end_styled = editor.SendScintilla(QsciScintilla.SCI_GETENDSTYLED)
+        last = min(self.idle_line + self.idle_lines, line_count) - 1
+        started = time.perf_counter()
+        self.style_lines(self.idle_line, last, converge=False)
+        elapsed = time.perf_counter() - started
+        self.idle_line = last + 1
+        if editor.SendScintilla(QsciScintilla.SCI_GETENDSTYLED) < end_styled:
+            # lines further down were styled from a guess and are on screen, Scintilla
+            # would style them from the guess again if the styled end moved above them
+            self.startStyling(end_styled)
+        # the next chunk should take about IDLE_SLICE
+        self.idle_lines = max(int(self.idle_lines * min(IDLE_SLICE / max(elapsed, 1e-6), 2.0)), 1)
+
+    def start_background(self):
+        length = self.editor.SendScintilla(QsciScintilla.SCI_GETLENGTH)
+        # the thread can't touch Scintilla, it gets a copy of the text
+        self.worker.style(self.version, self.editor.bytes(0, length).data()[:length])
+
+    def background_ready(self, version: int, styled: StyledText):
+        if version != self.version:
+            if self.background_pending:
+                self.start_background()
+            return
+        self.styled = styled
+        self.styled_version = version
+
+        # what is on screen first, the rest from the top while the event loop is idle
+        top = self.editor.SendScintilla(QsciScintilla.SCI_DOCLINEFROMVISIBLE,
+                                        self.editor.SendScintilla(QsciScintilla.SCI_GETFIRSTVISIBLELINE))
+        self.apply_lines(top, top + self.editor.SendScintilla(QsciScintilla.SCI_LINESONSCREEN) + 1)
+        self.apply_line = 0
+        self.apply_timer.start()
+
+    def apply_chunk(self):
+        if self.styled is None or self.styled_version != self.version:
+            self.apply_timer.stop()
+            return
+        end = min(self.apply_line + APPLY_CHUNK_LINES, self.styled.line_count())
+        self.apply_lines(self.apply_line, end)
+        self.apply_line = end
+        if end >= self.styled.line_count():
+            self.apply_timer.stop()
+            self.background_pending = False
+            self.dirty_end = -1
+
+    def apply_lines(self, first: int, end: int):
+        """Copy the styles and line states of lines [first, end) from the background result"""
+        styled = self.styled
+        end = min(end, styled.line_count())
+        if first >= end:
+            return
+        editor = self.editor
+        self.startStyling(styled.line_start(first))
+        styles = styled.styles(first, end)
+        editor.SendScintilla(QsciScintilla.SCI_SETSTYLINGEX, len(styles), styles)
+        for line in range(first, end):
+            editor.SendScintilla(QsciScintilla.SCI_SETLINESTATE, line, styled.line_states[line])
+
+    def style_line(self, text: str, state: int) -> int:
+        runs, state = self.syntax.style_line(text, state)
+        for length, style in runs:
+            self.setStyling(length, style)
+        return state
+
+
+class PyCustomLexer(TableLexer):
+    """Custom lexer for python"""
 
-        # 2. Slice out part from the text
-        text = self.editor.text()[start:end]
+    def __init__(self, editor):
+        super(PyCustomLexer, self).__init__(editor, PYTHON)
 
-        # 3. Tokenize the text
-        self.generate_token(text)
 
-        # Flags
-        string_flag = False
-        comment_flag = False
+def too_big_to_highlight(path) -> bool:
+    try:
+        return path is not None and os.path.getsize(path) > MAX_HIGHLIGHT_SIZE
+    except OSError:
+        return False
 
-        if start > 0:
-            prev_style = self.editor.SendScintilla(self.editor.SCI_GETSTYLEAT, start -1)
-            if prev_style == self.COMMENTS:
-                comment_flag = False
 
-        while True:
-            curr_token = self.next_tok()
-
-            if curr_token is None:
-                break
-
-            tok: str = curr_token[0]
-            tok_len: int = curr_token[1]
-
-            if comment_flag:
-                self.setStyling(tok_len, self.COMMENTS)
-                if tok.startswith("\n"):
-                    comment_flag = False
-                continue
-
-
-            if string_flag:
-                self.setStyling(tok_len, self.STRING)
-                if tok == '"' or tok == "'":
-                    string_flag = False
-                continue
-
-            if tok == "class":
-                name, ni = self.skip_spaces_peek()
-                brac_or_colon, _ = self.skip_spaces_peek(ni)
-                if name[0].isidentifier() and brac_or_colon[0] in (":", "("):
-                    self.setStyling(tok_len, self.KEYWORD)
-                    _ = self.next_tok(ni)
-                    self.setStyling(name[1]+1, self.CLASSES)
-                    continue
-                else:
-                    self.setStyling(tok_len, self.KEYWORD)
-                    continue
-            elif tok == "def":
-                name, ni = self.skip_spaces_peek()
-                if name[0].isidentifier():
-                    self.setStyling(tok_len, self.KEYWORD)
-                    _ = self.next_tok(ni)
-                    self.setStyling(name[1]+1, self.FUNCTION_DEF)
-                    continue
-                else:
-                    self.setStyling(tok_len, self.KEYWORD)
-                    continue
-            elif tok in self.keywords_list:
-                self.setStyling(tok_len, self.KEYWORD)
-            elif tok.strip() == "." and self.peek_tok()[0].isidentifier():
-                self.setStyling(tok_len, self.DEFAULT)
-                curr_token = self.next_tok()
-                tok: str = curr_token[0]
-                tok_len: int = curr_token[1]
-                if self.peek_tok()[0] == "(":
-                    self.setStyling(tok_len, self.FUNCTIONS)
-                else:
-                    self.setStyling(tok_len, self.DEFAULT)
-                continue
-            elif tok.isnumeric() or tok == 'self':
-                self.setStyling(tok_len, self.CONSTANTS)
-            elif tok in ["(", ")", "{", "}", "[", "]"]:
-                self.setStyling(tok_len, self.BRACKETS)
-            elif tok == '"' or tok == "'":
-                self.setStyling(tok_len, self.STRING)
-                string_flag = True
-            elif tok == "#":
-                self.setStyling(tok_len, self.COMMENTS)
-                comment_flag = True
-            elif tok in self.builtin_names or tok in ['+', '-', '*', '/', '%', '=', '<', '>']:
-                self.setStyling(tok_len, self.TYPES)
-            else:
-                self.setStyling(tok_len, self.DEFAULT)
\ No newline at end of file
+def lexer_for_path(path, editor) -> Optional[NeutronLexer]:
+    """Lexer for the file type of `path`, None if there is no syntax for it or the file is too big"""
+    language = language_for_suffix(Path(path).suffix) if path else None
+    if language is None or too_big_to_highlight(path):
+        return None
+    if language is PYTHON:
+        return PyCustomLexer(editor)
+    return TableLexer(editor, language)
@@ -5,19 +5,26 @@ import re
 from pathlib import Path
 from typing import Optional
 
-from PyQt5.QtCore import QSize, Qt, QThread, pyqtSignal, QTimer, QEvent
+from PyQt5.QtCore import QModelIndex, QSize, Qt, QThread, pyqtSignal, QTimer, QEvent
 from PyQt5.QtGui import QFont, QIcon, QKeySequence, QPixmap, QKeyEvent, QTextCharFormat, QColor, QTextCursor
 from PyQt5.Qsci import QsciScintilla
 from PyQt5.QtWidgets import (QAction, QApplication, QCheckBox, QFileDialog,
                                  QFrame, QHBoxLayout, QLabel, QLineEdit,
-                                 QListWidget, QMessageBox, QMainWindow, QMenu,
+                                 QListView, QMessageBox, QMainWindow, QMenu, QProgressBar,
                                  QSizePolicy, QSpacerItem, QSplitter, QStatusBar,
                                  QTabWidget, QVBoxLayout, QWidget, QTextEdit)
 from PyQt5.QtCore import QProcess
 
+from analysis import AnalysisClient
 from editor import Editor
 from file_manager import FileManager
-from fuzzy_searcher import SearchItem, SearchWorker
+from latency import LatencyStats
+from fuzzy_searcher import FuzzyFinderDialog, FuzzyIndexWorker, SearchResultModel, SearchWorker, WorkspaceSymbolsDialog
+
+# delay (ms) between the last keystroke in the search box and the search
+SEARCH_DEBOUNCE_MS = 200
+# shorter queries are only searched on Enter
+MIN_LIVE_SEARCH_LENGTH = 2
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -62,6 +69,39 @@ class MainWindow(QMainWindow):
         stat.showMessage("Ready", 3000)
         self.setStatusBar(stat)
 
+        # busy indicator of slow background work the user waits for
+        self.progress = QProgressBar()
+        self.progress.setRange(0, 0)
+        self.progress.setMaximumWidth(120)
+        self.progress.setMaximumHeight(12)
+        self.progress.setTextVisible(False)
+        self.progress.hide()
+        self.progress_tasks = 0
+        stat.addPermanentWidget(self.progress)
+
+        # p50 / p95 of the recent completion requests, every stage in the tooltip
+        self.latency_label = QLabel()
+        stat.addPermanentWidget(self.latency_label)
+
+    def show_completion_latency(self):
+        stats = LatencyStats.get()
+        total = stats.percentiles("total")
+        if total is None:
+            return
+        self.latency_label.setText(f"Completion {total[0]:.0f} / {total[1]:.0f} ms")
+        self.latency_label.setToolTip("Completion latency p50 / p95 (samples)\n" + "\n".join(stats.describe()))
+
+    def start_progress(self, message: str):
+        self.progress_tasks += 1
+        self.progress.show()
+        self.statusBar().showMessage(message)
+
+    def stop_progress(self):
+        self.progress_tasks = max(self.progress_tasks - 1, 0)
+        if not self.progress_tasks:
+            self.progress.hide()
+            self.statusBar().clearMessage()
+
     def set_up_menu(self):
         menu_bar = self.menuBar()
 
@@ -79,6 +119,14 @@ class MainWindow(QMainWindow):
         open_folder.setShortcut("Ctrl+K")
         open_folder.triggered.connect(self.open_folder)
 
+        go_to_file = file_menu.addAction("Go to File")
+        go_to_file.setShortcut("Ctrl+P")
+        go_to_file.triggered.connect(self.show_fuzzy_finder)
+
+        go_to_symbol = file_menu.addAction("Go to Symbol in Workspace")
+        go_to_symbol.setShortcut("Ctrl+T")
+        go_to_symbol.triggered.connect(self.show_workspace_symbols)
+
         file_menu.addSeparator()
 
         save_file = QAction("Save", self)
@@ -119,24 +167,39 @@ class MainWindow(QMainWindow):
         editor = Editor(self, path=path, is_python_file=is_python_file)
         return editor
 
-    def is_binary(self, path):
-        try:
-            with open(path, 'rb') as f:
-                return b'\0' in f.read(1024)
-        except IOError:
-            return True
+    def find_tab(self, path: Path) -> int:
+        """Index of the tab editing `path`, -1 if it isn't open"""
+        full_path = str(path.absolute())
+        for i in range(self.tab_view.count()):
+            if self.tab_view.widget(i).full_path == full_path:
+                return i
+        return -1
 
-    def set_new_tab(self, path: Path, is_new_file=False):
-        if not is_new_file and self.is_binary(path):
+    def read_file(self, path: Path) -> Optional[str]:
+        """Text of a file from a single read, None for folders, binary and undecodable files"""
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            # folders fail with a permission error on windows
+            if not path.is_dir():
+                self.statusBar().showMessage(f"Cannot Open {path.name}", 2000)
+            return None
+        # same sniffing as the project search, on the buffer that was just read
+        if b"\0" in data[:1024]:
             self.statusBar().showMessage("Cannot Open Binary File", 2000)
-            return
-
-        if path.is_dir():
-            return
-
-        editor = self.get_editor(path, path.suffix in {".py", ".pyw"})
+            return None
+        try:
+            text = data.decode("utf-8")
+        except UnicodeDecodeError:
+            QMessageBox.warning(self, "Error", f"Could not decode file {path.name} with UTF-8.  Try opening in a different encoding.")
+            return None
+        # universal newlines, like reading in text mode
+        return text.replace("\r\n", "\n").replace("\r", "\n")
 
+    def set_new_tab(self, path: Path, is_new_file=False):
         if is_new_file:
+            editor = self.get_editor(path, path.suffix in {".py", ".pyw"})
             self.tab_view.addTab(editor, "untitled")
             self.setWindowTitle(self.app_name)
             self.statusBar().showMessage("Opened untitled")
@@ -144,20 +207,19 @@ class MainWindow(QMainWindow):
             self.current_file = None
             return
 
-        # check if file already open
-        for i in range(self.tab_view.count()):
-            if self.tab_view.tabText(i) == path.name or self.tab_view.tabText(i) == "*"+path.name:
-                self.tab_view.setCurrentIndex(i)
-                self.current_file = path
-                return
+        # an open file only switches tabs, nothing is read or built
+        index = self.find_tab(path)
+        if index != -1:
+            self.tab_view.setCurrentIndex(index)
+            self.current_file = path
+            return
 
-        # create new tab
-        editor = self.get_editor(path, path.suffix in {".py", ".pyw"})
-        try:
-            editor.setText(path.read_text(encoding="utf-8"))
-        except UnicodeDecodeError:
-            QMessageBox.warning(self, "Error", f"Could not decode file {path.name} with UTF-8.  Try opening in a different encoding.")
+        text = self.read_file(path)
+        if text is None:
             return
+
+        editor = self.get_editor(path, path.suffix in {".py", ".pyw"})
+        editor.setText(text)
         self.tab_view.addTab(editor, path.name)
         self.setWindowTitle(f"{path.name} - {self.app_name}")
         self.current_file = path
@@ -277,13 +339,21 @@ class MainWindow(QMainWindow):
         search_layout.setContentsMargins(0, 10, 0, 0)
         search_layout.setSpacing(0)
 
-        search_input = QLineEdit()
-        search_input.setPlaceholderText("Search")
-        search_input.setFont(self.window_font)
-        search_input.setAlignment(Qt.AlignmentFlag.AlignTop)
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText("Search")
+        self.search_input.setFont(self.window_font)
+        self.search_input.setAlignment(Qt.AlignmentFlag.AlignTop)
+        self.search_input.textChanged.connect(self.search_text_changed)
+        self.search_input.returnPressed.connect(self.search_return_pressed)
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DEBOUNCE_MS)
+        self.search_timer.timeout.connect(self.start_search)
+        self.last_search: Optional[tuple] = None
 
         self.search_checkbox = QCheckBox("Search in modules")
         self.search_checkbox.setFont(self.window_font)
+        self.search_checkbox.toggled.connect(self.search_text_changed)
         self.search_checkbox.setStyleSheet("""
             QListWidget {
                 background-color: #21252b;
@@ -293,11 +363,31 @@ class MainWindow(QMainWindow):
                 color: #D3D3D3;
             }
         """)
-        self.search_list_view = QListWidget()
-        self.search_list_view.itemClicked.connect(self.search_list_view_clicked)
+        self.search_model = SearchResultModel(self)
+        self.search_list_view = QListView()
+        self.search_list_view.setModel(self.search_model)
+        self.search_list_view.setUniformItemSizes(True)
+        self.search_list_view.setLayoutMode(QListView.Batched)
+        self.search_list_view.clicked.connect(self.search_list_view_clicked)
+
+        self.search_worker = SearchWorker()
+        self.search_worker.results.connect(self.search_results)
+        self.search_worker.finished.connect(self.search_finshed)
+
+        self.fuzzy_index_worker = FuzzyIndexWorker()
+        self.fuzzy_index_worker.set_root(self.file_manager.model.rootPath())
+        self.fuzzy_index_worker.refresh()
+        self.fuzzy_finder = FuzzyFinderDialog(self.fuzzy_index_worker, self)
+
+        self.analysis_client = AnalysisClient.get()
+        self.analysis_client.open_folder(self.file_manager.model.rootPath())
+        self.fuzzy_finder.picked.connect(self.fuzzy_finder_picked)
+        self.workspace_symbols = WorkspaceSymbolsDialog(self.analysis_client, self)
+        self.workspace_symbols.set_root(self.file_manager.model.rootPath())
+        self.workspace_symbols.picked.connect(self.fuzzy_finder_picked)
 
         search_layout.addWidget(self.search_checkbox)
-        search_layout.addWidget(search_input)
+        search_layout.addWidget(self.search_input)
         search_layout.addSpacerItem(QSpacerItem(5, 5, QSizePolicy.Minimum, QSizePolicy.Minimum))
         search_layout.addWidget(self.search_list_view)
         self.search_frame.setLayout(search_layout)
@@ -333,17 +423,75 @@ class MainWindow(QMainWindow):
 
         self.setCentralWidget(body_frame)
 
-    def search_finshed(self, items):
-        self.search_list_view.clear()
-        for i in items:
-            self.search_list_view.addItem(i)
+    def search_text_changed(self):
+        # restarting the timer coalesces fast typing into one search
+        if len(self.search_input.text()) >= MIN_LIVE_SEARCH_LENGTH or not self.search_input.text():
+            self.search_timer.start()
+        else:
+            self.search_timer.stop()
+
+    def search_return_pressed(self):
+        self.search_timer.stop()
+        self.last_search = None
+        self.start_search()
+
+    def start_search(self):
+        search = (self.search_input.text(), self.file_manager.model.rootPath(), self.search_checkbox.isChecked())
+        if search == self.last_search:
+            return
+        self.last_search = search
 
-    def search_list_view_clicked(self, item: SearchItem):
+        self.search_model.clear()
+        if not search[0]:
+            self.search_worker.cancel()
+            return
+        self.search_worker.update(*search)
+
+    def search_results(self, search_id: int, hits):
+        # batches of a search that was superseded may still be queued
+        if search_id != self.search_worker.search_id:
+            return
+        self.search_model.append(hits)
+
+    def search_finshed(self, count: int):
+        self.statusBar().showMessage(f"{count} search results", 2000)
+
+    def search_list_view_clicked(self, index: QModelIndex):
+        item = self.search_model.item(index)
         self.set_new_tab(Path(item.full_path))
         editor: Editor = self.tab_view.currentWidget()
         editor.setCursorPosition(item.lineno, item.end)
         editor.setFocus()
 
+    def show_fuzzy_finder(self):
+        self.fuzzy_finder.popup()
+
+    def show_workspace_symbols(self):
+        self.workspace_symbols.popup()
+
+    def show_references(self, references: list):
+        # the references take the place of the search results
+        self.search_worker.cancel()
+        self.last_search = None
+        self.search_model.clear()
+        self.search_model.append([
+            (r["path"], r["line"] - 1, r["column"], r["text"].strip()[:50]) for r in references
+        ])
+        if self.search_frame not in self.hsplit.children():
+            self.hsplit.insertWidget(0, self.search_frame)
+        self.search_frame.show()
+        self.statusBar().showMessage(f"{len(references)} references", 2000)
+
+    def fuzzy_finder_picked(self, path: str, lineno: int):
+        self.set_new_tab(Path(path))
+        editor: Editor = self.tab_view.currentWidget()
+        if editor is None:
+            return
+        if lineno >= 0:
+            editor.setCursorPosition(lineno, 0)
+            editor.ensureLineVisible(lineno)
+        editor.setFocus()
+
     def show_dialog(self, title, msg) -> int:
         dialog = QMessageBox(self)
         dialog.setFont(self.font())
@@ -364,6 +512,9 @@ class MainWindow(QMainWindow):
             )
             if dialog == QMessageBox.Yes:
                 self.save_file()
+        closed: Editor = self.tab_view.widget(index)
+        if closed.is_python_file:
+            closed.document.close()
         self.tab_view.removeTab(index)
 
     def show_hide_tab(self, e, type_):
@@ -403,6 +554,8 @@ class MainWindow(QMainWindow):
         editor = self.tab_view.currentWidget()
         try:
             self.current_file.write_text(editor.text())
+            self.search_worker.file_changed(str(self.current_file))
+            self.analysis_client.file_saved(str(self.current_file))
             self.statusBar().showMessage(f"Saved {self.current_file.name}", 2000)
             editor.current_file_changed = False
         except Exception as e:
@@ -421,9 +574,19 @@ class MainWindow(QMainWindow):
         path = Path(file_path)
         try:
             path.write_text(editor.text())
+            self.search_worker.file_changed(str(path))
+            if editor.path is not None and editor.path != path:
+                # the old file may have been renamed or removed meanwhile
+                self.search_worker.file_changed(str(editor.path))
+            self.analysis_client.file_saved(str(path))
             self.tab_view.setTabText(self.tab_view.currentIndex(), path.name)
             self.statusBar().showMessage(f"Saved {path.name}", 2000)
             self.current_file = path
+            # the tab now stands for the new file when it is opened again
+            editor.path = path
+            editor.full_path = str(path.absolute())
+            if editor.is_python_file:
+                editor.document.rename(editor.full_path)
             editor.current_file_changed = False
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Could not save file: {e}")
@@ -452,6 +615,10 @@ class MainWindow(QMainWindow):
         if new_folder:
             self.file_manager.model.setRootPath(new_folder)
             self.file_manager.setRootIndex(self.file_manager.model.index(new_folder))
+            self.fuzzy_index_worker.set_root(new_folder)
+            self.fuzzy_index_worker.refresh()
+            self.analysis_client.open_folder(new_folder)
+            self.workspace_symbols.set_root(new_folder)
             self.statusBar().showMessage(f"Opened {new_folder}", 2000)
 
     def copy(self):
@@ -0,0 +1,290 @@
+import io
+import mmap
+import multiprocessing
+import os
+import re
+import threading
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+# (lineno, match end, preview)
+Hit = Tuple[int, int, str]
+
+# scanning is mostly bound by reading files, more processes only cost startup and memory
+MAX_WORKERS = 8
+# files are sent to the pool in chunks to keep the per task overhead low
+CHUNK_FILES = 64
+CHUNK_BYTES = 1024 * 1024
+# chunks submitted ahead of the one being consumed, per worker
+IN_FLIGHT_PER_WORKER = 4
+# files bigger than this are mmapped and searched with a bytes regex
+MMAP_THRESHOLD = 4 * 1024 * 1024
+# files bigger than this are skipped
+MAX_FILE_SIZE = 512 * 1024 * 1024
+# newlines of mmapped files are counted this many bytes at a time
+COUNT_CHUNK = 1024 * 1024
+
+
+def prefilter_for(pattern: str, flags: int) -> Optional[re.Pattern]:
+    """Pattern that matches the whole text whenever `pattern` matches one of its lines.
+
+    Anchors to the start/end of the string and lookarounds could see across
+    lines, those patterns are only matched line by line. So are $ and \\B:
+    lines keep their newline, at the end of a line they can match after it,
+    where the whole text goes on with the next line.
+    """
+    if '\\A' in pattern or '\\Z' in pattern or '(?' in pattern or '$' in pattern or '\\B' in pattern:
+        return None
+    return re.compile(pattern, flags | re.MULTILINE)
+
+
+# escapes whose bytes version matches one byte or ASCII only, instead of one character
+BYTE_CLASS_ESCAPES = frozenset('wWsSdDbB')
+ESCAPE_RE = re.compile(r'\\(.)', re.DOTALL)
+
+
+def bytes_pattern_for(pattern: str, flags: int) -> Optional[re.Pattern]:
+    """Bytes version of `pattern` for finding candidate lines in mmapped files.
+
+    It must match wherever `pattern` matches a line, so patterns with ., negated
+    classes or class escapes like \\w, which only cover one byte or ASCII in a
+    bytes pattern, aren't converted. Neither are patterns whose meaning depends
+    on line endings.
+    """
+    if not pattern.isascii() or '$' in pattern or prefilter_for(pattern, flags) is None:
+        return None
+    # escaped chars are literals, except the class escapes
+    unescaped = ESCAPE_RE.sub(lambda m: '\\w' if m.group(1) in BYTE_CLASS_ESCAPES else '', pattern)
+    if '.' in unescaped or '[^' in unescaped or '\\' in unescaped:
+        return None
+    try:
+        return re.compile(pattern.encode('ascii'), (flags & ~re.UNICODE) | re.MULTILINE)
+    except re.error:
+        return None
+
+
+def count_newlines(mm: mmap.mmap, start: int, end: int) -> int:
+    """Newlines in mm[start:end], without copying more than COUNT_CHUNK bytes at once"""
+    count = 0
+    for pos in range(start, end, COUNT_CHUNK):
+        count += mm[pos:min(pos + COUNT_CHUNK, end)].count(b'\n')
+    return count
+
+
+def scan_mmap(mm: mmap.mmap, breg: re.Pattern, reg: re.Pattern) -> List[Hit]:
+    """Search a whole buffer for lines `breg` matches, then match them with `reg`.
+
+    Line numbers, columns and previews are only computed for those lines, the
+    same way scan_stream does.
+    """
+    hits = []
+    lineno = 0
+    counted = 0
+    pos = 0
+    size = len(mm)
+    while pos < size:
+        m = breg.search(mm, pos)
+        if m is None:
+            break
+
+        line_start = mm.rfind(b'\n', 0, m.start()) + 1
+        line_end = mm.find(b'\n', m.start())
+        if line_end == -1:
+            line_end = size
+
+        lineno += count_newlines(mm, counted, line_start)
+        counted = line_start
+
+        # the line as reading the file line by line gives it, newline included
+        raw = mm[line_start:line_end].rstrip(b'\r')
+        line = raw.decode('utf8', errors='replace') + ('\n' if line_end < size else '')
+        if sm := reg.search(line):
+            hits.append((lineno, sm.end(), line[sm.start():].strip()[:50]))
+
+        pos = line_end + 1
+    return hits
+
+
+def scan_stream(path: str, reg: re.Pattern) -> Optional[List[Hit]]:
+    """Search a file line by line without loading it into memory"""
+    hits = []
+    try:
+        with open(path, 'r', encoding='utf8') as f:
+            for i, line in enumerate(f):
+                if m := reg.search(line):
+                    hits.append((i, m.end(), line[m.start():].strip()[:50]))
+    except UnicodeDecodeError:  # not utf8, can't be shown in the results anyway
+        return None
+    except OSError:
+        return None
+    return hits
+
+
+def scan_large_file(path: str, reg: re.Pattern, breg: Optional[re.Pattern]) -> Optional[List[Hit]]:
+    try:
+        with open(path, 'rb') as f:
+            if b'\0' in f.read(1024):
+                return None
+            if breg is not None:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    return scan_mmap(mm, breg, reg)
+    except (OSError, ValueError):
+        pass
+    return scan_stream(path, reg)
+
+
+def scan_file(path: str, reg: re.Pattern, prefilter: re.Pattern = None,
+              breg: re.Pattern = None, max_file_size: int = MAX_FILE_SIZE) -> Optional[List[Hit]]:
+    """Search a file with a single read. Returns None for binary, unreadable or too big files"""
+    try:
+        size = os.path.getsize(path)
+        if size > max_file_size:
+            return None
+        if size > MMAP_THRESHOLD:
+            return scan_large_file(path, reg, breg)
+
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+
+    if b'\0' in data[:1024]:
+        return None
+
+    try:
+        text = data.decode('utf8')
+    except UnicodeDecodeError:  # not utf8, can't be shown in the results anyway
+        return None
+
+    hits = []
+    if '\r' in text:
+        # text mode reads \r\n and \r as \n
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    if prefilter is not None and not prefilter.search(text):
+        return hits
+
+    # same lines as iterating a file opened in text mode, newlines included
+    for i, line in enumerate(io.StringIO(text)):
+        if m := reg.search(line):
+            hits.append((i, m.end(), line[m.start():].strip()[:50]))
+    return hits
+
+
+def scan_files(paths: List[str], pattern: str, flags: int,
+               max_file_size: int = MAX_FILE_SIZE) -> List[Optional[List[Hit]]]:
+    reg = re.compile(pattern, flags)
+    prefilter = prefilter_for(pattern, flags)
+    breg = bytes_pattern_for(pattern, flags)
+    return [scan_file(p, reg, prefilter, breg, max_file_size) for p in paths]
+
+
+def chunked(paths: Iterable[Tuple[str, int]]) -> Iterator[List[str]]:
+    """Group (path, size) pairs into chunks of similar cost"""
+    chunk = []
+    size = 0
+    for path, file_size in paths:
+        chunk.append(path)
+        size += file_size
+        if len(chunk) >= CHUNK_FILES or size >= CHUNK_BYTES:
+            yield chunk
+            chunk = []
+            size = 0
+    if chunk:
+        yield chunk
+
+
+def pool_context() -> multiprocessing.context.BaseContext:
+    """Start method of the scanner processes.
+
+    Forking the editor would copy its Qt state and threads into the workers,
+    they are forked from a server that only imported this module instead, or
+    spawned where there is no fork server.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload([__name__])
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+class ParallelScanner:
+    """Fans file scanning out to a pool and yields the results in input order.
+
+    A process pool is used so regex matching runs on all cores, a thread pool
+    is used instead where processes can't be started.
+    """
+
+    def __init__(self, workers: int = None, use_processes: bool = True, max_file_size: int = MAX_FILE_SIZE):
+        self.workers = workers or min(os.cpu_count() or 1, MAX_WORKERS)
+        self.use_processes = use_processes
+        self.max_file_size = max_file_size
+        self.executor: Executor = None
+        self.lock = threading.Lock()
+
+    def get_executor(self) -> Executor:
+        with self.lock:
+            if self.executor is None:
+                if self.use_processes and self.workers > 1:
+                    try:
+                        self.executor = ProcessPoolExecutor(self.workers, mp_context=pool_context())
+                    except (OSError, ValueError, NotImplementedError) as e:
+                        print(f"ParallelScanner error: {e}")
+                        self.use_processes = False
+                if self.executor is None:
+                    self.executor = ThreadPoolExecutor(self.workers)
+            return self.executor
+
+    def warm_up(self):
+        """Start the pool with a single worker ahead of the first search, blocks until it is ready.
+
+        That is when the fork server imports this module, the other workers
+        are forked from it on demand and start quickly.
+        """
+        executor = self.get_executor()
+        try:
+            executor.submit(scan_files, [], "", 0).result()
+        except Exception as e:  # the first search falls back to a thread pool
+            print(f"ParallelScanner error: {e}")
+
+    def scan(self, files: Iterable[Tuple[str, int]], pattern: str,
+             flags: int = re.IGNORECASE) -> Iterator[Tuple[str, Optional[List[Hit]]]]:
+        """Yield (path, hits) for the (path, size) pairs in `files`, in the same order.
+
+        hits is None for binary, undecodable or unreadable files. Stopping the
+        iteration cancels the chunks that haven't started yet.
+        """
+        executor = self.get_executor()
+        max_in_flight = self.workers * IN_FLIGHT_PER_WORKER
+        in_flight = deque()
+        chunks = chunked(files)
+
+        try:
+            for chunk in chunks:
+                in_flight.append((chunk, executor.submit(scan_files, chunk, pattern, flags, self.max_file_size)))
+                if len(in_flight) < max_in_flight:
+                    continue
+                yield from self._collect(*in_flight.popleft(), pattern, flags)
+
+            while in_flight:
+                yield from self._collect(*in_flight.popleft(), pattern, flags)
+        finally:
+            for _, future in in_flight:
+                future.cancel()
+
+    def _collect(self, chunk: List[str], future, pattern: str, flags: int) -> Iterator[Tuple[str, Optional[List[Hit]]]]:
+        try:
+            results = future.result()
+        except Exception as e:  # a broken pool, fall back to scanning here
+            if self.use_processes:
+                print(f"ParallelScanner error: {e}")
+                self.shutdown()
+                self.use_processes = False
+            results = scan_files(chunk, pattern, flags, self.max_file_size)
+        yield from zip(chunk, results)
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = None
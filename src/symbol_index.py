@@ -0,0 +1,473 @@
+import ast
+import hashlib
+import os
+import sqlite3
+import threading
+from array import array
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from fuzzy import FuzzyFinder
+from trigram_index import cache_dir
+from walker import Walker
+
+INDEX_VERSION = 2
+MAX_INDEX_FILE_SIZE = 1024 * 1024
+# files parsed between two commits while a folder is indexed
+COMMIT_EVERY = 200
+# imports followed to find where a re-exported name is defined
+MAX_IMPORT_HOPS = 5
+PYTHON_SUFFIXES = (".py", ".pyw")
+
+
+class Symbol(NamedTuple):
+    """A module level name, methods are named Class.method"""
+    name: str
+    kind: str  # class, function, variable or import
+    line: int  # 1 based
+    column: int
+    # imports: the absolute module and the name in it, None for a module import
+    module: Optional[str] = None
+    target: Optional[str] = None
+
+
+def module_name(root: str, path: str) -> str:
+    """Dotted module name of a file relative to a folder"""
+    rel = os.path.splitext(os.path.relpath(path, root))[0]
+    parts = rel.replace("\\", "/").split("/")
+    if parts[-1] == "__init__":
+        parts.pop()
+    return ".".join(parts)
+
+
+def absolute_module(module: str, is_package: bool, level: int, name: Optional[str]) -> str:
+    """Resolve the module of a `from ... import`, relative to `module`"""
+    if not level:
+        return name or ""
+    parts = module.split(".") if module else []
+    # a module's own package is one level up, a package is its own
+    drop = level - 1 if is_package else level
+    base = parts[:len(parts) - drop] if drop else parts
+    return ".".join(base + ([name] if name else []))
+
+
+def statements(body: List[ast.stmt]) -> Iterator[ast.stmt]:
+    """Module level statements, including the ones in if / try / with blocks"""
+    for node in body:
+        yield node
+        if isinstance(node, (ast.If, ast.With, ast.AsyncWith)):
+            yield from statements(node.body)
+            yield from statements(getattr(node, "orelse", []))
+        elif isinstance(node, ast.Try):
+            yield from statements(node.body)
+            for handler in node.handlers:
+                yield from statements(handler.body)
+            yield from statements(node.orelse)
+            yield from statements(node.finalbody)
+
+
+def target_names(target: ast.expr) -> Iterator[ast.Name]:
+    if isinstance(target, ast.Name):
+        yield target
+    elif isinstance(target, (ast.Tuple, ast.List)):
+        for element in target.elts:
+            yield from target_names(element)
+    elif isinstance(target, ast.Starred):
+        yield from target_names(target.value)
+
+
+def binding_count(tree: ast.AST, name: str) -> int:
+    """How often `name` is bound anywhere in a module, in any scope"""
+    count = 0
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            count += node.id == name and not isinstance(node.ctx, ast.Load)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            count += node.name == name
+        elif isinstance(node, ast.arg):
+            count += node.arg == name
+        elif isinstance(node, ast.alias):
+            count += (node.asname or node.name.split(".")[0]) == name
+        elif isinstance(node, ast.ExceptHandler):
+            count += node.name == name
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            count += name in node.names
+    return count
+
+
+def name_column(node: ast.stmt) -> int:
+    """Column of the name of a def / class, assuming single spaces after the keywords"""
+    keyword = {ast.ClassDef: "class ", ast.FunctionDef: "def ", ast.AsyncFunctionDef: "async def "}
+    return node.col_offset + len(keyword[type(node)])
+
+
+def tree_symbols(tree: ast.Module, module: str = "", is_package: bool = False) -> List[Symbol]:
+    symbols = []
+    for node in statements(tree.body):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            symbols.append(Symbol(node.name, "function", node.lineno, name_column(node)))
+        elif isinstance(node, ast.ClassDef):
+            symbols.append(Symbol(node.name, "class", node.lineno, name_column(node)))
+            for member in node.body:
+                if isinstance(member, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                    kind = "class" if isinstance(member, ast.ClassDef) else "function"
+                    symbols.append(Symbol(f"{node.name}.{member.name}", kind, member.lineno, name_column(member)))
+        elif isinstance(node, (ast.Assign, ast.AnnAssign, ast.AugAssign)):
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            for target in targets:
+                for name in target_names(target):
+                    symbols.append(Symbol(name.id, "variable", name.lineno, name.col_offset))
+        elif isinstance(node, ast.Import):
+            for alias in node.names:
+                if alias.asname:
+                    symbols.append(Symbol(alias.asname, "import", node.lineno, node.col_offset, alias.name))
+                else:
+                    # `import a.b` binds `a`
+                    top = alias.name.split(".")[0]
+                    symbols.append(Symbol(top, "import", node.lineno, node.col_offset, top))
+        elif isinstance(node, ast.ImportFrom):
+            source_module = absolute_module(module, is_package, node.level, node.module)
+            for alias in node.names:
+                if alias.name == "*":
+                    continue
+                symbols.append(Symbol(alias.asname or alias.name, "import", node.lineno, node.col_offset,
+                                      source_module, alias.name))
+    return symbols
+
+
+def occurrences(tree: ast.Module) -> Dict[str, Tuple[array, array]]:
+    """name -> (positions as a plain name, positions as an attribute), as flat line, column arrays"""
+    found: Dict[str, Tuple[array, array]] = {}
+
+    def add(name: str, line: int, column: int, attribute: bool = False):
+        entry = found.get(name)
+        if entry is None:
+            entry = found[name] = (array("I"), array("I"))
+        entry[attribute].extend((line, column))
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            add(node.id, node.lineno, node.col_offset)
+        elif isinstance(node, ast.Attribute):
+            add(node.attr, node.end_lineno, max(node.end_col_offset - len(node.attr), 0), True)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            add(node.name, node.lineno, name_column(node))
+        elif isinstance(node, ast.arg):
+            add(node.arg, node.lineno, node.col_offset)
+        elif isinstance(node, ast.ImportFrom):
+            for alias in node.names:
+                # aliases only have a position since python 3.10
+                add(alias.name, getattr(alias, "lineno", node.lineno), getattr(alias, "col_offset", node.col_offset))
+    return found
+
+
+def read_file(path: str, module: str) -> Tuple[List[Symbol], Dict[str, Tuple[array, array]]]:
+    """Symbols and name occurrences of a python file, empty if it can't be parsed"""
+    try:
+        with open(path, "rb") as f:
+            tree = ast.parse(f.read().decode("utf-8"))
+    except (OSError, UnicodeDecodeError, SyntaxError, ValueError, RecursionError):
+        return [], {}
+    return tree_symbols(tree, module, os.path.basename(path).startswith("__init__.")), occurrences(tree)
+
+
+# path, line, column
+Location = Tuple[str, int, int]
+
+SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE files (id INTEGER PRIMARY KEY, path TEXT UNIQUE, module TEXT, mtime REAL);
+CREATE INDEX files_module ON files (module);
+CREATE TABLE names (id INTEGER PRIMARY KEY, name TEXT UNIQUE);
+CREATE TABLE symbols (file INTEGER, name TEXT, kind TEXT, line INTEGER, col INTEGER, module TEXT, target TEXT);
+CREATE INDEX symbols_file ON symbols (file, name);
+CREATE INDEX symbols_name ON symbols (name, kind);
+-- positions of one name in one file, packed (line, column) uint32 pairs
+CREATE TABLE refs (name INTEGER, file INTEGER, plain BLOB, attributes BLOB, PRIMARY KEY (name, file)) WITHOUT ROWID;
+CREATE INDEX refs_file ON refs (file);
+"""
+
+
+class IndexDatabase:
+    """SQLite file with the symbols and name occurrences of the python files of one folder"""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.path = os.path.join(cache_dir(), hashlib.sha1(root.encode("utf-8")).hexdigest() + ".symbols.db")
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.db = self.connect(self.path)
+        except (OSError, sqlite3.Error) as e:
+            print(f"SymbolIndex error: {e}")
+            self.db = self.connect(":memory:")
+        self.names: Dict[str, int] = dict(self.db.execute("SELECT name, id FROM names"))
+        # path -> (id, mtime, module)
+        self.files: Dict[str, Tuple[int, float, str]] = {}
+        # last part of a module name -> {file id: (module, path)}, imports are resolved by suffix
+        self.modules: Dict[str, Dict[int, Tuple[str, str]]] = {}
+        for file_id, path, mtime, module in self.db.execute("SELECT id, path, mtime, module FROM files"):
+            self.files[path] = (file_id, mtime, module)
+            self.modules.setdefault(module.rpartition(".")[2], {})[file_id] = (module, path)
+        self.uncommitted = 0
+
+    @staticmethod
+    def connect(path: str) -> sqlite3.Connection:
+        db = sqlite3.connect(path, check_same_thread=False)
+        try:
+            version = db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        except sqlite3.DatabaseError:
+            version = None
+        if version != (str(INDEX_VERSION),):
+            db.close()
+            if path != ":memory:" and os.path.exists(path):
+                os.remove(path)
+            db = sqlite3.connect(path, check_same_thread=False)
+            db.executescript(SCHEMA)
+            db.execute("INSERT INTO meta VALUES ('version', ?)", (str(INDEX_VERSION),))
+            db.commit()
+        return db
+
+    def name_id(self, name: str) -> int:
+        name_id = self.names.get(name)
+        if name_id is None:
+            name_id = self.names[name] = self.db.execute("INSERT INTO names (name) VALUES (?)", (name,)).lastrowid
+        return name_id
+
+    def update(self, path: str, mtime: float, module: str, symbols: List[Symbol],
+               found: Dict[str, Tuple[array, array]]):
+        entry = self.files.get(path)
+        if entry is None:
+            file_id = self.db.execute("INSERT INTO files (path, module, mtime) VALUES (?, ?, ?)",
+                                      (path, module, mtime)).lastrowid
+        else:
+            file_id = entry[0]
+            self.modules[entry[2].rpartition(".")[2]].pop(file_id, None)
+            self.db.execute("UPDATE files SET module = ?, mtime = ? WHERE id = ?", (module, mtime, file_id))
+            self.db.execute("DELETE FROM symbols WHERE file = ?", (file_id,))
+            self.db.execute("DELETE FROM refs WHERE file = ?", (file_id,))
+        self.files[path] = (file_id, mtime, module)
+        self.modules.setdefault(module.rpartition(".")[2], {})[file_id] = (module, path)
+        self.db.executemany("INSERT INTO symbols VALUES (?, ?, ?, ?, ?, ?, ?)", [
+            (file_id, s.name, s.kind, s.line, s.column, s.module, s.target) for s in symbols
+        ])
+        self.db.executemany("INSERT INTO refs VALUES (?, ?, ?, ?)", [
+            (self.name_id(name), file_id, plain.tobytes(), attributes.tobytes())
+            for name, (plain, attributes) in found.items()
+        ])
+        self.uncommitted += 1
+
+    def remove(self, path: str):
+        entry = self.files.pop(path, None)
+        if entry is not None:
+            self.modules[entry[2].rpartition(".")[2]].pop(entry[0], None)
+            for table, column in (("files", "id"), ("symbols", "file"), ("refs", "file")):
+                self.db.execute(f"DELETE FROM {table} WHERE {column} = ?", (entry[0],))
+            self.uncommitted += 1
+
+    def find_module(self, module: str) -> List[Tuple[int, str, bool]]:
+        """(file id, path, exact) of the files named `module` or ending with `.module`"""
+        suffix = "." + module
+        return [
+            (file_id, path, name == module)
+            for file_id, (name, path) in self.modules.get(module.rpartition(".")[2], {}).items()
+            if name == module or name.endswith(suffix)
+        ]
+
+    def commit(self):
+        if self.uncommitted:
+            self.db.commit()
+            self.uncommitted = 0
+
+
+def positions(blob: bytes) -> Iterator[Tuple[int, int]]:
+    values = array("I")
+    values.frombytes(blob)
+    return zip(values[::2], values[1::2])
+
+
+class SymbolIndex:
+    """Symbols and references of the python files of the opened folders.
+
+    Every folder has an SQLite database in the cache directory holding the
+    module level symbols and the positions of every name per file, updated
+    by mtime, so opening a folder again only parses what changed. It is
+    filled by a background thread and read by the request loop, a lock
+    guards the connections.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.roots: List[str] = []
+        self.databases: Dict[str, IndexDatabase] = {}
+        # fuzzy finder over the symbols, rebuilt by the indexing thread
+        self.finder = FuzzyFinder()
+        self.finder_dirty = False
+
+    def root_of(self, path: str) -> Optional[str]:
+        roots = [r for r in self.roots if path.startswith(r + os.sep)]
+        return max(roots, key=len) if roots else None
+
+    def databases_of(self, path: str) -> List[IndexDatabase]:
+        """Databases of every opened folder containing `path`, nested folders share files"""
+        return [d for root, d in self.databases.items() if path.startswith(root + os.sep)]
+
+    def add_root(self, root: str):
+        if root in self.databases:
+            return
+        database = IndexDatabase(root)
+        with self.lock:
+            self.databases[root] = database
+            self.roots.append(root)
+            self.finder_dirty = True
+
+    def update_file(self, path: str, mtime: float = None, commit: bool = True,
+                    database: Optional[IndexDatabase] = None) -> bool:
+        """(Re)parse a file if it changed, in `database` or every folder containing it.
+
+        Returns False when it isn't indexed.
+        """
+        databases = [database] if database is not None else self.databases_of(path)
+        if not databases or not path.endswith(PYTHON_SUFFIXES):
+            return False
+        if mtime is None:
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                self.remove_file(path)
+                return False
+        for database in databases:
+            entry = database.files.get(path)
+            if entry is not None and entry[1] == mtime:
+                continue
+            # module names are relative to each folder
+            module = module_name(database.root, path)
+            symbols, found = read_file(path, module)
+            with self.lock:
+                database.update(path, mtime, module, symbols, found)
+                if commit or database.uncommitted >= COMMIT_EVERY:
+                    database.commit()
+                self.finder_dirty = True
+        return True
+
+    def remove_file(self, path: str):
+        with self.lock:
+            for database in self.databases_of(path):
+                database.remove(path)
+                database.commit()
+                self.finder_dirty = True
+
+    def index_root(self, root: str, cancelled=lambda: False):
+        self.add_root(root)
+        database = self.databases[root]
+        seen = set()
+        for path, mtime, size in Walker.for_root(root).walk():
+            if cancelled():
+                break
+            if size > MAX_INDEX_FILE_SIZE or not path.endswith(PYTHON_SUFFIXES):
+                continue
+            seen.add(path)
+            self.update_file(path, mtime, commit=False, database=database)
+        with self.lock:
+            if not cancelled():
+                for path in [p for p in database.files if p not in seen]:
+                    database.remove(path)
+            database.commit()
+
+    def build_finder(self):
+        with self.lock:
+            self.finder_dirty = False
+            rows = []
+            for database in self.databases.values():
+                rows += database.db.execute(
+                    "SELECT s.name, s.kind, f.path, s.line, s.col FROM symbols s JOIN files f ON f.id = s.file "
+                    "WHERE s.kind != 'import'").fetchall()
+        # files of nested folders are in several databases
+        rows = list(dict.fromkeys(rows))
+        self.finder = FuzzyFinder([row[0] for row in rows], rows)
+
+    def search(self, query: str, k: int = 50) -> List[Tuple[str, str, str, int, int]]:
+        """(name, kind, path, line, column) of the symbols best matching a fuzzy query"""
+        return self.finder.match(query, k)
+
+    def find_module(self, module: str, near: Optional[str] = None) -> Optional[Tuple[IndexDatabase, int, str]]:
+        """(database, file id, path) of an imported module.
+
+        Folders like src/ are often on sys.path, so `walker` can be indexed
+        as `src.walker`, the candidate closest to `near` wins.
+        """
+        candidates = []
+        with self.lock:
+            for database in self.databases.values():
+                for file_id, path, exact in database.find_module(module):
+                    if exact:
+                        return database, file_id, path
+                    candidates.append((database, file_id, path))
+        if not candidates:
+            return None
+        if near is None:
+            return min(candidates, key=lambda c: len(c[2]))
+        near_dir = os.path.dirname(near)
+        return max(candidates, key=lambda c: (len(os.path.commonpath([near_dir, c[2]])), -len(c[2])))
+
+    def module_location(self, module: str, near: Optional[str] = None) -> Optional[Location]:
+        found = self.find_module(module, near)
+        return (found[2], 1, 0) if found else None
+
+    def lookup(self, module: str, name: str, near: Optional[str] = None) -> Optional[Location]:
+        """Where `name` of `module` is defined, following re-exports"""
+        for _ in range(MAX_IMPORT_HOPS):
+            found = self.find_module(module, near)
+            if found is None:
+                return None
+            database, file_id, path = found
+            with self.lock:
+                row = database.db.execute(
+                    "SELECT kind, line, col, module, target FROM symbols WHERE file = ? AND name = ?",
+                    (file_id, name)).fetchone()
+            if row is None:
+                # a submodule imported through its package
+                return self.module_location(f"{module}.{name}", path)
+            kind, line, column, target_module, target = row
+            if kind != "import":
+                return path, line, column
+            if target is None:
+                return self.module_location(target_module, path)
+            module, name, near = target_module, target, path
+        return None
+
+    def references(self, name: str, definition: Location) -> List[Location]:
+        """Positions of `name` that can refer to the definition at `definition`.
+
+        Plain names count in the defining file and in the files importing
+        the definition, attributes with that name count everywhere.
+        """
+        def_path, def_line, _ = definition
+        with self.lock:
+            rows = []
+            for database in self.databases.values():
+                name_id = database.names.get(name)
+                if name_id is None:
+                    continue
+                rows += [
+                    (database, *row) for row in database.db.execute(
+                        "SELECT f.id, f.path, r.plain, r.attributes FROM refs r JOIN files f ON f.id = r.file "
+                        "WHERE r.name = ?", (name_id,))
+                ]
+            imports = {}
+            for database in self.databases.values():
+                for file_id, module, target in database.db.execute(
+                        "SELECT file, module, target FROM symbols WHERE name = ? AND kind = 'import'", (name,)):
+                    imports[database.root, file_id] = (module, target)
+
+        found = []
+        for database, file_id, path, plain, attributes in rows:
+            refers = path == def_path
+            if not refers:
+                imported = imports.get((database.root, file_id))
+                if imported is not None:
+                    module, target = imported
+                    location = self.lookup(module, target, path) if target else self.module_location(module, path)
+                    refers = location is not None and location[:2] == (def_path, def_line)
+            if refers:
+                found += [(path, line, column) for line, column in positions(plain)]
+            found += [(path, line, column) for line, column in positions(attributes)]
+        return sorted(set(found))
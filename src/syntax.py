@@ -0,0 +1,352 @@
+import builtins
+import keyword
+import re
+import types
+from array import array
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+# style ids, the same ones NeutronLexer maps to the theme
+DEFAULT = 0
+KEYWORD = 1
+TYPES = 2
+STRING = 3
+KEYARGS = 4
+BRACKETS = 5
+COMMENTS = 6
+CONSTANTS = 7
+FUNCTIONS = 8
+CLASSES = 9
+FUNCTION_DEF = 10
+# style id -> name used in theme files
+STYLE_NAMES = [
+    "default", "keyword", "types", "string", "keyargs", "brackets",
+    "comments", "constants", "functions", "classes", "function_def",
+]
+
+# line state outside of any multi-line region
+STATE_DEFAULT = 0
+
+# (utf-8 length, style)
+StyleRun = Tuple[int, int]
+
+CALL_RE = re.compile(r"\s*\(")
+# style id -> one byte of that style, for building SCI_SETSTYLINGEX buffers
+STYLE_BYTES = [bytes([i]) for i in range(256)]
+
+
+class Rule(NamedTuple):
+    """Text matching `pattern` gets `style`"""
+    pattern: str
+    style: int
+
+
+class Region(NamedTuple):
+    """Text from `start` up to and including `end`, it may span lines if `multiline`.
+
+    Without an end pattern the region runs to the end of the line. Characters
+    after `escape` never end the region.
+    """
+    start: str
+    end: Optional[str]
+    style: int
+    multiline: bool = False
+    escape: Optional[str] = None
+
+
+class Language:
+    """Tokenizer built from declarative rules.
+
+    All rules and region starts are compiled into one regex with a named group
+    each, so a token costs one match and one dict lookup. Words that no rule
+    claims are looked up in `keywords`, the word after one of `follows` gets
+    its style (def name, class name) and a word followed by "(" gets
+    `call_style`. Single characters are looked up in `punctuation`.
+    """
+
+    def __init__(self, name: str, suffixes: Iterable[str], rules: Iterable[Rule] = (),
+                 regions: Iterable[Region] = (), keywords: Dict[str, int] = None,
+                 follows: Dict[str, int] = None, punctuation: Dict[str, int] = None,
+                 call_style: int = None, flags: int = 0):
+        self.name = name
+        self.suffixes = frozenset(suffixes)
+        self.rules = list(rules)
+        self.regions = list(regions)
+        self.keywords = dict(keywords or {})
+        self.follows = dict(follows or {})
+        self.punctuation = dict(punctuation or {})
+        self.call_style = call_style
+
+        groups = []
+        # group name -> style for rules, group name -> region index for regions
+        self.rule_styles: Dict[str, int] = {}
+        self.region_groups: Dict[str, int] = {}
+        for i, region in enumerate(self.regions):
+            groups.append(f"(?P<region{i}>{region.start})")
+            self.region_groups[f"region{i}"] = i
+        for i, rule in enumerate(self.rules):
+            groups.append(f"(?P<rule{i}>{rule.pattern})")
+            self.rule_styles[f"rule{i}"] = rule.style
+        groups.append(r"(?P<space>\s+)")
+        groups.append(r"(?P<word>[^\W\d]\w*)")
+        groups.append(r"(?P<other>\w+|.)")
+        self.token_re = re.compile("|".join(groups), flags)
+
+        self.region_ends = []
+        for region in self.regions:
+            if region.end is None:
+                self.region_ends.append(None)
+                continue
+            end = region.end
+            if region.escape is not None:
+                end = f"{re.escape(region.escape)}.|{end}"
+            self.region_ends.append(re.compile(end, flags))
+
+    def region_state(self, index: int) -> int:
+        return index + 1
+
+    def _end_region(self, text: str, pos: int, index: int) -> Tuple[int, bool]:
+        """Position after the end of region `index` searched from `pos`, and whether it ended"""
+        end_re = self.region_ends[index]
+        if end_re is None:
+            return len(text), False
+        escape = self.regions[index].escape
+        while True:
+            m = end_re.search(text, pos)
+            if m is None:
+                return len(text), False
+            pos = m.end()
+            if escape is None or not m.group().startswith(escape):
+                return pos, True
+
+    def style_line(self, text: str, state: int = STATE_DEFAULT) -> Tuple[List[StyleRun], int]:
+        """Style runs covering `text` (one line with its line ending) and the state at its end"""
+        runs: List[StyleRun] = []
+        ascii_text = text.isascii()
+        pos = 0
+        size = len(text)
+        prev_word = None
+
+        def add(end: int, style: int):
+            length = end - pos if ascii_text else len(text[pos:end].encode("utf-8"))
+            if runs and runs[-1][1] == style:
+                runs[-1] = (runs[-1][0] + length, style)
+            else:
+                runs.append((length, style))
+
+        if state != STATE_DEFAULT:
+            index = state - 1
+            end, closed = self._end_region(text, 0, index)
+            add(end, self.regions[index].style)
+            pos = end
+            if not closed:
+                return runs, state
+
+        token_re = self.token_re
+        keywords = self.keywords
+        while pos < size:
+            m = token_re.match(text, pos)
+            kind = m.lastgroup
+            end = m.end()
+
+            if kind == "space":
+                add(end, DEFAULT)
+                pos = end
+                continue
+
+            if kind == "word":
+                word = m.group()
+                style = self.follows.get(prev_word)
+                if style is None:
+                    style = keywords.get(word)
+                if style is None:
+                    if self.call_style is not None and CALL_RE.match(text, end):
+                        style = self.call_style
+                    else:
+                        style = DEFAULT
+                prev_word = word
+            elif kind == "other":
+                style = self.punctuation.get(m.group(), DEFAULT)
+                prev_word = None
+            elif kind in self.rule_styles:
+                style = self.rule_styles[kind]
+                prev_word = None
+            else:
+                index = self.region_groups[kind]
+                region = self.regions[index]
+                end, closed = self._end_region(text, end, index)
+                add(end, region.style)
+                pos = end
+                if not closed and region.multiline:
+                    return runs, self.region_state(index)
+                prev_word = None
+                continue
+
+            add(end, style)
+            pos = end
+
+        return runs, STATE_DEFAULT
+
+
+class StyledText:
+    """Style runs of a whole document as compact arrays.
+
+    Run i covers `run_lengths[i]` bytes from byte offset `run_starts[i]`, the
+    runs of line n start at index `line_runs[n]`.
+    """
+
+    def __init__(self):
+        self.run_starts = array("Q")
+        self.run_lengths = array("I")
+        self.run_styles = array("B")
+        self.line_runs = array("I")
+        # state at the end of every line
+        self.line_states = array("H")
+
+    def line_count(self) -> int:
+        return len(self.line_runs)
+
+    def line_start(self, line: int) -> int:
+        if line < len(self.line_runs):
+            return self.run_starts[self.line_runs[line]]
+        if not self.run_starts:
+            return 0
+        return self.run_starts[-1] + self.run_lengths[-1]
+
+    def styles(self, first_line: int, end_line: int) -> bytes:
+        """One style byte per byte of lines [first_line, end_line)"""
+        first = self.line_runs[first_line] if first_line < len(self.line_runs) else len(self.run_styles)
+        last = self.line_runs[end_line] if end_line < len(self.line_runs) else len(self.run_styles)
+        return b"".join(STYLE_BYTES[style] * length
+                        for style, length in zip(self.run_styles[first:last], self.run_lengths[first:last]))
+
+
+def style_document(language: Language, data: bytes, state: int = STATE_DEFAULT,
+                   cancelled: Callable[[], bool] = None) -> Optional[StyledText]:
+    """Style utf-8 `data` line by line, None if `cancelled` returned True on the way"""
+    styled = StyledText()
+    offset = 0
+    for i, raw in enumerate(data.splitlines(keepends=True)):
+        if cancelled is not None and i % 1000 == 0 and cancelled():
+            return None
+        runs, state = language.style_line(raw.decode("utf-8", errors="replace"), state)
+        styled.line_runs.append(len(styled.run_styles))
+        styled.line_states.append(state)
+        for length, style in runs:
+            styled.run_starts.append(offset)
+            styled.run_lengths.append(length)
+            styled.run_styles.append(style)
+            offset += length
+    return styled
+
+
+BRACKET_STYLES = {c: BRACKETS for c in "(){}[]"}
+
+PYTHON_STRING_PREFIX = r"(?i:[rbfu]|rb|br|fr|rf)?"
+
+PYTHON = Language(
+    "Python", (".py", ".pyw"),
+    regions=[
+        Region(PYTHON_STRING_PREFIX + '"""', '"""', STRING, multiline=True, escape="\\"),
+        Region(PYTHON_STRING_PREFIX + "'''", "'''", STRING, multiline=True, escape="\\"),
+        Region(PYTHON_STRING_PREFIX + '"', '"', STRING, escape="\\"),
+        Region(PYTHON_STRING_PREFIX + "'", "'", STRING, escape="\\"),
+        Region("#", None, COMMENTS),
+    ],
+    rules=[
+        Rule(r"\d[\w.]*", CONSTANTS),
+    ],
+    keywords={
+        **{name: TYPES for name, obj in vars(builtins).items() if isinstance(obj, types.BuiltinFunctionType)},
+        **{kw: KEYWORD for kw in keyword.kwlist},
+        "self": CONSTANTS,
+    },
+    follows={"def": FUNCTION_DEF, "class": CLASSES},
+    punctuation={**BRACKET_STYLES, **{c: TYPES for c in "+-*/%=<>"}},
+    call_style=FUNCTIONS,
+)
+
+JSON = Language(
+    "JSON", (".json",),
+    rules=[
+        Rule(r'"(?:[^"\\]|\\.)*"(?=\s*:)', KEYARGS),
+        Rule(r'"(?:[^"\\]|\\.)*"?', STRING),
+        Rule(r"-?\d[\d.eE+\-]*", CONSTANTS),
+    ],
+    keywords={"true": CONSTANTS, "false": CONSTANTS, "null": CONSTANTS},
+    punctuation=BRACKET_STYLES,
+)
+
+MARKDOWN = Language(
+    "Markdown", (".md", ".markdown"),
+    regions=[
+        Region(r"^\s*```.*", r"^\s*```\s*$", STRING, multiline=True),
+        Region(r"^\s*<!--", "-->", COMMENTS, multiline=True),
+    ],
+    rules=[
+        Rule(r"^#{1,6}\s.*", KEYWORD),
+        Rule(r"^\s*>.*", COMMENTS),
+        Rule(r"^\s*(?:[-*+]|\d+\.)(?=\s)", BRACKETS),
+        Rule(r"`[^`]*`", STRING),
+        Rule(r"!?\[[^\]]*\]\([^)]*\)", FUNCTIONS),
+        Rule(r"\*\*[^*]+\*\*|__[^_]+__", CLASSES),
+        Rule(r"\*[^*\s][^*]*\*|_[^_\s][^_]*_", TYPES),
+    ],
+)
+
+JAVASCRIPT = Language(
+    "JavaScript", (".js", ".mjs", ".cjs", ".jsx"),
+    regions=[
+        Region(r"/\*", r"\*/", COMMENTS, multiline=True),
+        Region("`", "`", STRING, multiline=True, escape="\\"),
+        Region('"', '"', STRING, escape="\\"),
+        Region("'", "'", STRING, escape="\\"),
+        Region("//", None, COMMENTS),
+    ],
+    rules=[
+        Rule(r"\d[\w.]*", CONSTANTS),
+    ],
+    keywords={
+        **{kw: KEYWORD for kw in (
+            "async", "await", "break", "case", "catch", "class", "const", "continue", "debugger",
+            "default", "delete", "do", "else", "export", "extends", "finally", "for", "from",
+            "function", "if", "import", "in", "instanceof", "let", "new", "of", "return", "static",
+            "super", "switch", "throw", "try", "typeof", "var", "void", "while", "with", "yield",
+        )},
+        **{name: TYPES for name in (
+            "Array", "Boolean", "Date", "Error", "JSON", "Map", "Math", "Number", "Object",
+            "Promise", "RegExp", "Set", "String", "Symbol", "console", "document", "window",
+        )},
+        **{name: CONSTANTS for name in ("true", "false", "null", "undefined", "this", "NaN", "Infinity")},
+    },
+    follows={"function": FUNCTION_DEF, "class": CLASSES},
+    punctuation={**BRACKET_STYLES, **{c: TYPES for c in "+-*/%=<>!&|?"}},
+    call_style=FUNCTIONS,
+)
+
+TOML = Language(
+    "TOML", (".toml",),
+    regions=[
+        Region('"""', '"""', STRING, multiline=True, escape="\\"),
+        Region("'''", "'''", STRING, multiline=True),
+        Region('"', '"', STRING, escape="\\"),
+        Region("'", "'", STRING),
+        Region("#", None, COMMENTS),
+    ],
+    rules=[
+        Rule(r"^\s*\[\[?[^\]]*\]\]?", CLASSES),
+        Rule(r"^\s*[\w.\-]+(?=\s*=)", KEYARGS),
+        Rule(r"[+-]?\d[\w.:+\-]*", CONSTANTS),
+    ],
+    keywords={"true": CONSTANTS, "false": CONSTANTS, "inf": CONSTANTS, "nan": CONSTANTS},
+    punctuation={**BRACKET_STYLES, "=": TYPES},
+)
+
+LANGUAGES = [PYTHON, JSON, MARKDOWN, JAVASCRIPT, TOML]
+
+
+def language_for_suffix(suffix: str) -> Optional[Language]:
+    suffix = suffix.lower()
+    for language in LANGUAGES:
+        if suffix in language.suffixes:
+            return language
+    return None
@@ -0,0 +1,108 @@
+import json
+import os
+from typing import Dict, NamedTuple, Optional
+
+from PyQt5.QtCore import QFileSystemWatcher, QObject, pyqtSignal
+from PyQt5.QtGui import QColor, QFont
+
+from syntax import STYLE_NAMES
+
+# theme.json next to src/, found wherever the editor is started from
+DEFAULT_THEME_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "theme.json")
+
+FONT_WEIGHTS = {
+    "thin": QFont.Thin,
+    "extralight": QFont.ExtraLight,
+    "light": QFont.Light,
+    "normal": QFont.Normal,
+    "medium": QFont.Medium,
+    "demibold": QFont.DemiBold,
+    "bold": QFont.Bold,
+    "extrabold": QFont.ExtraBold,
+    "black": QFont.Black,
+}
+
+
+class ThemeStyle(NamedTuple):
+    """Compiled settings of one syntax style, None where the theme doesn't set them"""
+    color: Optional[QColor]
+    paper: Optional[QColor]
+    font: Optional[QFont]
+
+
+def compile_syntax(data: dict) -> Dict[str, ThemeStyle]:
+    """style name -> ThemeStyle for the "syntax" section of a theme file"""
+    styles = {}
+    for entry in data["theme"]["syntax"]:
+        for name, settings in entry.items():
+            if name not in STYLE_NAMES:
+                print(f"Theme error: {name} is not a valid style name")
+                continue
+
+            color = paper = font = None
+            for k, v in settings.items():
+                if k == "color":
+                    color = QColor(v)
+                elif k == "paper-color":
+                    paper = QColor(v)
+                elif k == "font":
+                    weight = FONT_WEIGHTS.get(v.get("font-weight", "normal"))
+                    if weight is None:
+                        print(f"Theme error: unknown font-weight {v.get('font-weight')}")
+                        weight = QFont.Normal
+                    font = QFont(v.get("family", "Consolas"), v.get("font-size", 14), weight, v.get("italic", False))
+            styles[name] = ThemeStyle(color, paper, font)
+    return styles
+
+
+class Theme(QObject):
+    """A theme file parsed once and shared by every lexer.
+
+    The file is watched, when it changes it is parsed again and `changed` is
+    emitted so open editors can restyle. A broken file keeps the last good
+    theme.
+    """
+    changed = pyqtSignal()
+
+    _instances: Dict[str, "Theme"] = {}
+
+    @classmethod
+    def get(cls, path: str) -> "Theme":
+        path = os.path.abspath(path)
+        theme = cls._instances.get(path)
+        if theme is None:
+            theme = cls._instances[path] = cls(path)
+        return theme
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self.data: dict = {}
+        self.styles: Dict[str, ThemeStyle] = {}
+        self.load()
+
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.fileChanged.connect(self.file_changed)
+        self.watch()
+
+    def watch(self):
+        # editors that save by replacing the file make the watcher drop it
+        if os.path.exists(self.path) and self.path not in self.watcher.files():
+            self.watcher.addPath(self.path)
+
+    def load(self) -> bool:
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            styles = compile_syntax(data)
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            print(f"Theme error: {e}")
+            return False
+        self.data = data
+        self.styles = styles
+        return True
+
+    def file_changed(self, path: str):
+        self.watch()
+        if self.load():
+            self.changed.emit()
@@ -0,0 +1,252 @@
+import hashlib
+import os
+import pickle
+import re
+import threading
+import time
+from array import array
+from typing import Dict, List, Optional, Set, Tuple
+
+from walker import Walker
+
+try:
+    import re._parser as sre_parse
+except ImportError:  # python < 3.11
+    import sre_parse
+
+INDEX_VERSION = 1
+# files bigger than this are not indexed, they are always treated as candidates
+MAX_INDEXED_SIZE = 4 * 1024 * 1024
+
+
+def cache_dir() -> str:
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "zrax", "index")
+
+
+def file_trigrams(data: bytes) -> Set[bytes]:
+    """Set of lower-cased 3 byte sequences found in `data`"""
+    data = data.lower()
+    return {data[i:i + 3] for i in range(len(data) - 2)}
+
+
+def _literal_runs(parsed) -> List[str]:
+    """Literal strings that every match of the parsed pattern must contain"""
+    runs = []
+    current = []
+    for op, arg in parsed:
+        if op is sre_parse.LITERAL and arg < 128:
+            current.append(chr(arg))
+            continue
+        if current:
+            runs.append("".join(current))
+            current = []
+        if op is sre_parse.SUBPATTERN:
+            runs.extend(_literal_runs(arg[-1]))
+    if current:
+        runs.append("".join(current))
+    return runs
+
+
+def query_trigrams(pattern: str) -> Optional[Set[bytes]]:
+    """Trigrams required by `pattern`, or None when the index can't narrow the search"""
+    try:
+        parsed = sre_parse.parse(pattern, re.IGNORECASE)
+    except re.error:
+        return None
+
+    trigrams = set()
+    for run in _literal_runs(parsed.data):
+        trigrams |= file_trigrams(run.encode("ascii"))
+    return trigrams or None
+
+
+class TrigramIndex:
+    """On-disk trigram index of a directory tree.
+
+    Every text file is reduced to the set of trigrams it contains, queries only
+    have to look at the files whose posting lists contain all the trigrams of
+    the pattern. The index is refreshed incrementally by comparing mtime/size.
+    """
+
+    def __init__(self, walker: Walker):
+        self.walker = walker
+        self.root = walker.root
+
+        key = f"{self.root}|{sorted(walker.exclude_dirs)}|{sorted(walker.exclude_suffixes)}|{walker.use_ignore_files}"
+        self.path = os.path.join(cache_dir(), hashlib.sha1(key.encode("utf-8")).hexdigest() + ".idx")
+
+        self.paths: List[Optional[str]] = []   # file id -> path, None for removed files
+        self.ids: Dict[str, int] = {}
+        self.stats: Dict[int, Tuple[float, int]] = {}
+        self.file_grams: Dict[int, array] = {}
+        self.postings: Dict[bytes, Set[int]] = {}
+        self.unindexed: Set[int] = set()  # too big to index, always candidates
+        self.binary: Set[int] = set()
+
+        self.last_refresh = 0.0
+        self.dirty = False
+        # held while the index changes, refreshes run next to searches
+        self.lock = threading.RLock()
+        # bumped whenever a file is added, changed or removed
+        self.generation = 0
+
+    # ---------------------------------------------------------------- storage
+
+    def load(self) -> bool:
+        try:
+            with open(self.path, "rb") as f:
+                state = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError):
+            return False
+
+        if state.get("version") != INDEX_VERSION or state.get("root") != self.root:
+            return False
+
+        self.paths = state["paths"]
+        self.ids = {p: i for i, p in enumerate(self.paths) if p is not None}
+        self.stats = state["stats"]
+        self.file_grams = state["file_grams"]
+        self.unindexed = state["unindexed"]
+        self.binary = state["binary"]
+        self.postings = {}
+        for file_id, grams in self.file_grams.items():
+            for g in grams:
+                self.postings.setdefault(g.to_bytes(3, "big"), set()).add(file_id)
+        return True
+
+    def save(self):
+        if not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".tmp"
+        try:
+            with self.lock, open(tmp, "wb") as f:
+                pickle.dump({
+                    "version": INDEX_VERSION,
+                    "root": self.root,
+                    "paths": self.paths,
+                    "stats": self.stats,
+                    "file_grams": self.file_grams,
+                    "unindexed": self.unindexed,
+                    "binary": self.binary,
+                }, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self.path)
+            self.dirty = False
+        except OSError as e:
+            print(f"TrigramIndex error: {e}")
+
+    # --------------------------------------------------------------- updating
+
+    def _drop(self, file_id: int):
+        for g in self.file_grams.pop(file_id, ()):
+            posting = self.postings.get(g.to_bytes(3, "big"))
+            if posting is not None:
+                posting.discard(file_id)
+        self.unindexed.discard(file_id)
+        self.binary.discard(file_id)
+
+    def _remove(self, path: str):
+        with self.lock:
+            file_id = self.ids.pop(path, None)
+            if file_id is None:
+                return
+            self._drop(file_id)
+            self.stats.pop(file_id, None)
+            self.paths[file_id] = None
+            self.dirty = True
+            self.generation += 1
+
+    def update_file(self, path: str, mtime: float = None, size: int = None):
+        """(Re)index a single file, does nothing if it didn't change"""
+        path = os.path.abspath(path)
+        if mtime is None:
+            try:
+                st = os.stat(path)
+            except OSError:
+                self._remove(path)
+                return
+            mtime, size = st.st_mtime, st.st_size
+
+        with self.lock:
+            self._update_file(path, mtime, size)
+
+    def _update_file(self, path: str, mtime: float, size: int):
+        file_id = self.ids.get(path)
+        stat_key = (mtime, size)
+        if file_id is not None and self.stats.get(file_id) == stat_key:
+            return
+
+        if file_id is None:
+            file_id = len(self.paths)
+            self.paths.append(path)
+            self.ids[path] = file_id
+        else:
+            self._drop(file_id)
+
+        self.stats[file_id] = stat_key
+        self.dirty = True
+        self.generation += 1
+
+        if size > MAX_INDEXED_SIZE:
+            self.unindexed.add(file_id)
+            return
+
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            self.binary.add(file_id)
+            return
+
+        if b"\0" in data[:1024]:
+            self.binary.add(file_id)
+            self.walker.mark_binary(path)
+            return
+
+        grams = file_trigrams(data)
+        self.file_grams[file_id] = array("I", (int.from_bytes(g, "big") for g in grams))
+        for g in grams:
+            self.postings.setdefault(g, set()).add(file_id)
+
+    def refresh(self):
+        """Bring the index up to date with the file system.
+
+        Only files whose mtime/size changed are read again, so with the
+        walker's caches this mostly costs the directory listings and stats.
+        The walk doesn't hold the lock, searches only wait for changed files.
+        """
+        seen = set()
+        for path, mtime, size in self.walker.walk():
+            seen.add(path)
+            self.update_file(path, mtime, size)
+
+        with self.lock:
+            gone = [p for p in self.ids if p not in seen]
+        for path in gone:
+            self._remove(path)
+
+        self.last_refresh = time.monotonic()
+        self.save()
+
+    # ---------------------------------------------------------------- queries
+
+    def candidates(self, pattern: str) -> Optional[List[Tuple[str, int]]]:
+        """(path, size) of the files that may contain a match of `pattern`, in indexing order.
+
+        Returns None if the pattern has no literal part long enough to use the index.
+        """
+        grams = query_trigrams(pattern)
+        if grams is None:
+            return None
+
+        with self.lock:
+            postings = sorted((self.postings.get(g, set()) for g in grams), key=len)
+            file_ids = set(postings[0])
+            for posting in postings[1:]:
+                if not file_ids:
+                    break
+                file_ids &= posting
+            file_ids |= self.unindexed
+
+            return [(self.paths[i], self.stats[i][1]) for i in sorted(file_ids) if self.paths[i] is not None]
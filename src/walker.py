@@ -0,0 +1,254 @@
+import os
+import re
+import threading
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Optional, Tuple
+
+EXCLUDE_DIRS = frozenset({".git", ".svn", ".hg", ".bzr", ".idea", "__pycache__", "venv"})
+EXCLUDE_SUFFIXES = frozenset({".svg", ".png", ".exe", ".pyc", ".qm"})
+IGNORE_FILES = (".gitignore", ".ignore")
+
+# (path, mtime, size)
+FileEntry = Tuple[str, float, int]
+
+
+def glob_to_regex(pattern: str) -> str:
+    """Translate a gitignore glob (without the leading / trailing slashes) to a regex"""
+    out = []
+    i = 0
+    n = len(pattern)
+    while i < n:
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            out.append("(?:.*/)?")
+            i += 3
+            continue
+        if pattern.startswith("/**", i) and i + 3 == n:
+            out.append("/.*")
+            i += 3
+            continue
+        if pattern.startswith("**", i):
+            out.append(".*")
+            i += 2
+            continue
+        if c == "*":
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            end = pattern.find("]", i + 1)
+            if end == -1:
+                out.append("\\[")
+            else:
+                body = pattern[i + 1:end]
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                out.append("[" + body.replace("\\", "\\\\") + "]")
+                i = end
+        elif c == "\\" and i + 1 < n:
+            i += 1
+            out.append(re.escape(pattern[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return "".join(out)
+
+
+class IgnoreRules:
+    """Compiled rules of the ignore files of one directory"""
+
+    def __init__(self, lines: Iterable[str]):
+        # (regex, negated, dir only), in file order
+        self.rules: List[Tuple[re.Pattern, bool, bool]] = []
+        for line in lines:
+            line = line.rstrip("\n").rstrip("\r")
+            if not line.strip() or line.startswith("#"):
+                continue
+            if not line.endswith("\\ "):
+                line = line.rstrip()
+
+            negated = line.startswith("!")
+            if negated:
+                line = line[1:]
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+            if not line:
+                continue
+
+            # a slash anywhere but at the end anchors the pattern to this directory
+            anchored = "/" in line
+            line = line.lstrip("/")
+            regex = glob_to_regex(line)
+            if not anchored:
+                regex = "(?:.*/)?" + regex
+            try:
+                self.rules.append((re.compile(regex + r"\Z"), negated, dir_only))
+            except re.error:
+                continue
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    def match(self, rel_path: str, is_dir: bool) -> Optional[bool]:
+        """True if ignored, False if re-included, None if no rule applies"""
+        for regex, negated, dir_only in reversed(self.rules):
+            if dir_only and not is_dir:
+                continue
+            if regex.match(rel_path):
+                return not negated
+        return None
+
+
+class Walker:
+    """Directory walker shared by the search, the search index and the fuzzy finder.
+
+    It is built on os.scandir, skips excluded directories and suffixes and
+    honours .gitignore/.ignore files. Parsed ignore files are cached by mtime
+    and (mtime, size, is_binary) is cached per file, so walking an unchanged
+    tree again only costs the directory listings.
+    """
+
+    _instances: Dict[Tuple, "Walker"] = {}
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def for_root(cls, root: str, exclude_dirs: FrozenSet[str] = EXCLUDE_DIRS,
+                 exclude_suffixes: FrozenSet[str] = EXCLUDE_SUFFIXES, use_ignore_files: bool = True) -> "Walker":
+        """Shared walker for these settings, so all consumers use the same caches"""
+        key = (os.path.abspath(root), frozenset(exclude_dirs), frozenset(exclude_suffixes), use_ignore_files)
+        with cls._instances_lock:
+            walker = cls._instances.get(key)
+            if walker is None:
+                walker = cls._instances[key] = cls(*key)
+            return walker
+
+    def __init__(self, root: str, exclude_dirs: FrozenSet[str] = EXCLUDE_DIRS,
+                 exclude_suffixes: FrozenSet[str] = EXCLUDE_SUFFIXES, use_ignore_files: bool = True):
+        self.root = os.path.abspath(root)
+        self.exclude_dirs = frozenset(exclude_dirs)
+        self.exclude_suffixes = frozenset(exclude_suffixes)
+        self.use_ignore_files = use_ignore_files
+        # directory -> (mtimes of its ignore files, rules)
+        self.rules: Dict[str, Tuple[Tuple[float, ...], IgnoreRules]] = {}
+        # path -> (mtime, size, is_binary or None if not known yet)
+        self.files: Dict[str, Tuple[float, int, Optional[bool]]] = {}
+
+    def dir_rules(self, directory: str) -> Optional[IgnoreRules]:
+        mtimes = []
+        for name in IGNORE_FILES:
+            try:
+                mtimes.append(os.stat(os.path.join(directory, name)).st_mtime)
+            except OSError:
+                mtimes.append(-1.0)
+        mtimes = tuple(mtimes)
+
+        cached = self.rules.get(directory)
+        if cached is not None and cached[0] == mtimes:
+            return cached[1] or None
+
+        lines = []
+        for name, mtime in zip(IGNORE_FILES, mtimes):
+            if mtime < 0:
+                continue
+            try:
+                with open(os.path.join(directory, name), "r", encoding="utf8", errors="replace") as f:
+                    lines.extend(f)
+            except OSError:
+                continue
+        rules = IgnoreRules(lines)
+        self.rules[directory] = (mtimes, rules)
+        return rules or None
+
+    def is_ignored(self, rel_path: str, is_dir: bool, active: List[Tuple[str, IgnoreRules]]) -> bool:
+        # deeper ignore files take precedence over the ones above them
+        for base, rules in reversed(active):
+            result = rules.match(rel_path[len(base):], is_dir)
+            if result is not None:
+                return result
+        return False
+
+    def walk(self, path: str = None) -> Iterator[FileEntry]:
+        """Yield (path, mtime, size) for every file that isn't excluded or ignored, in name order"""
+        start = os.path.abspath(path or self.root)
+        rel_start = os.path.relpath(start, self.root).replace(os.sep, "/")
+        rel_start = "" if rel_start == "." else rel_start + "/"
+        seen = set()
+        stack = [(start, rel_start, self._parent_rules(start))]
+        while stack:
+            directory, rel_dir, active = stack.pop()
+            if self.use_ignore_files:
+                rules = self.dir_rules(directory)
+                if rules is not None:
+                    active = active + [(rel_dir, rules)]
+
+            try:
+                with os.scandir(directory) as it:
+                    entries = sorted(it, key=lambda e: e.name)
+            except OSError:
+                continue
+
+            subdirs = []
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    continue
+                name = entry.name
+
+                if is_dir:
+                    if name in self.exclude_dirs:
+                        continue
+                    if active and self.is_ignored(rel_dir + name, True, active):
+                        continue
+                    subdirs.append((entry.path, rel_dir + name + "/", active))
+                    continue
+
+                if os.path.splitext(name)[1] in self.exclude_suffixes:
+                    continue
+                if active and self.is_ignored(rel_dir + name, False, active):
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+
+                cached = self.files.get(entry.path)
+                if cached is None or cached[0] != st.st_mtime or cached[1] != st.st_size:
+                    self.files[entry.path] = (st.st_mtime, st.st_size, None)
+                seen.add(entry.path)
+                yield entry.path, st.st_mtime, st.st_size
+
+            # reversed so the stack pops them in name order
+            stack.extend(reversed(subdirs))
+
+        if start == self.root:
+            for gone in [p for p in self.files if p not in seen]:
+                del self.files[gone]
+
+    def _parent_rules(self, directory: str) -> List[Tuple[str, IgnoreRules]]:
+        """Rules of the directories between the root and `directory` (excluded)"""
+        active = []
+        if not self.use_ignore_files or directory == self.root:
+            return active
+        rel = os.path.relpath(directory, self.root)
+        if rel.startswith(".."):
+            return active
+        current = self.root
+        base = ""
+        for part in [""] + rel.split(os.sep)[:-1]:
+            if part:
+                current = os.path.join(current, part)
+                base += part + "/"
+            rules = self.dir_rules(current)
+            if rules is not None:
+                active.append((base, rules))
+        return active
+
+    def known_binary(self, path: str) -> bool:
+        """True only if the file was already found to be binary (or unsearchable)"""
+        cached = self.files.get(path)
+        return cached is not None and cached[2] is True
+
+    def mark_binary(self, path: str, binary: bool = True):
+        cached = self.files.get(path)
+        if cached is not None:
+            self.files[path] = (cached[0], cached[1], binary)